@@ -0,0 +1,120 @@
+import ast
+import importlib
+import threading
+from contextlib import contextmanager
+from random import Random
+
+from mcts_search import Searcher
+
+# One lock per bot module, held by the instance whose values are swapped into the module
+_module_locks = {}
+
+
+def parse_value(text):
+    """ Parses the value of a parameter given on the command line: a Python literal such as 0.5, None or (1, 2), or
+    else the text itself, e.g. for a module name.
+    """
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def parse_bot(spec):
+    """ Parses a bot specification: a module name, optionally followed by parameter overrides, as in
+    'mcts_modified:num_nodes=500,explore_faction=0.5'. Values are read with parse_value.
+
+    Returns:    The module name and the dictionary of overrides.
+
+    """
+    module_name, _, overrides = spec.partition(':')
+    settings = {}
+    for setting in filter(None, overrides.split(',')):
+        name, _, value = setting.partition('=')
+        if not name or not value:
+            raise ValueError("Bot overrides look like parameter=value, got %r in %r" % (setting, spec))
+        settings[name] = parse_value(value)
+    return module_name, settings
+
+
+def bot_spec(module_name, settings):
+    """ Returns the specification of a bot with parameter overrides, the inverse of parse_bot. """
+    if not settings:
+        return module_name
+    return '%s:%s' % (module_name, ','.join('%s=%r' % (name, value) for name, value in sorted(settings.items())))
+
+
+class BotInstance:
+    def __init__(self, module_name, settings=None, seed=None):
+        """ A bot module with parameters of its own, so that several configurations of a bot can play in one process,
+        even against each other.
+
+        The bots keep their parameters and their search state (random number generator, kept tree, telemetry, monitor)
+        in module globals. An instance holds its own values of those globals and swaps them into the module for the
+        duration of each think(), restoring the module's afterwards. Reading or setting any other attribute of the
+        module through the instance (e.g. bot.searcher or bot.monitor = ...) reads or sets the instance's value if it
+        has one. Since the values live in the module while an instance thinks, only one instance of a module may think
+        at a time: a think() started while another instance of the same module is thinking, on another thread or from
+        inside it, raises a RuntimeError rather than mixing their settings.
+
+        Args:
+            module_name:    The module name of the bot, e.g. 'mcts_modified'.
+            settings:       A dictionary of parameter overrides such as {'num_nodes': 500}.
+            seed:           The seed of the instance's random number generator, if the bot has one.
+
+        """
+        module = importlib.import_module(module_name)
+        settings = dict(settings or {})
+        for name in settings:
+            if not hasattr(module, name):
+                raise ValueError("%s has no parameter %r" % (module_name, name))
+        if hasattr(module, 'rng'):
+            settings['rng'] = Random(seed)
+        if hasattr(module, 'searcher'):
+            settings['searcher'] = Searcher(module.search)
+        for name in ('telemetry', 'monitor'):
+            if hasattr(module, name):
+                settings.setdefault(name, None)
+        self.__dict__.update(module=module, name=module_name, settings=settings,
+                             lock=_module_locks.setdefault(module_name, threading.Lock()))
+
+    @contextmanager
+    def applied(self):
+        """ Swaps the instance's values into the module's globals for the duration of a with block.
+
+        Raises:
+            RuntimeError:   If the module is already in use by an instance, on this thread or another.
+
+        """
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError("%s is already in use by another instance; instances of a bot module cannot think "
+                               "concurrently" % self.name)
+        module = self.module
+        saved = {name: getattr(module, name) for name in self.settings}
+        for name, value in self.settings.items():
+            setattr(module, name, value)
+        try:
+            yield module
+        finally:
+            for name, value in saved.items():
+                setattr(module, name, value)
+            self.lock.release()
+
+    def think(self, state, *args, **kwargs):
+        with self.applied() as module:
+            return module.think(state, *args, **kwargs)
+
+    def __getattr__(self, name):
+        settings = self.__dict__['settings']
+        if name in settings:
+            return settings[name]
+        return getattr(self.__dict__['module'], name)
+
+    def __setattr__(self, name, value):
+        if not hasattr(self.module, name):
+            raise AttributeError("%s has no parameter %r" % (self.name, name))
+        self.settings[name] = value
+
+    def __repr__(self):
+        return 'BotInstance(%r)' % bot_spec(self.name, {name: value for name, value in self.settings.items()
+                                                         if name not in ('rng', 'searcher', 'telemetry', 'monitor')})
@@ -0,0 +1,168 @@
+
+import tablebase
+
+# Bounds of the values kept in the memo table: exact, or only a lower or an upper bound after an alpha-beta cutoff
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class EndgameSolver:
+    def __init__(self, game, max_entries=1 << 20, table=None):
+        """ Solves positions of a game exactly with a memoized negamax search with alpha-beta pruning.
+
+        Positions are valued by their margin: the number of boxes the player to move will close from there on minus the
+        number the opponent will, with perfect play on both sides. Boxes already closed do not matter, nor does whose
+        turn it is, so the margin only depends on which lines are drawn and the memo table is keyed by the edge mask,
+        sharing entries between all the move orders and owners leading to the same lines.
+
+        Args:
+            game:           The game (see p2_game.create_game) of the positions to solve.
+            max_entries:    The number of memo table entries above which the table is cleared before a new solve.
+            table:          The endgame table of the board (see tablebase.load), answering every position directly, or
+                            None to search.
+
+        """
+        self.game = game
+        self.max_entries = max_entries
+        self.memo = {}
+        self.table = table
+        # The masks of the boxes every edge borders
+        self.edge_box_masks = tuple(tuple(game.box_edges[box] for box in boxes) for boxes in game.edge_boxes)
+
+    def ordered_moves(self, edges):
+        """ Lists the lines left to draw with the number of boxes each closes, captures first (the most boxes first),
+        then the lines that give no box away, then those that leave a box with three sides for the opponent.
+
+        Args:
+            edges:  The mask of the lines drawn.
+
+        Returns:    A list of (boxes closed, edge index) pairs.
+
+        """
+        captures, safe, unsafe = [], [], []
+        remaining = self.game.all_edges & ~edges
+        while remaining:
+            bit = remaining & -remaining
+            remaining ^= bit
+            drawn = edges | bit
+            closed = offered = 0
+            for box_mask in self.edge_box_masks[bit.bit_length() - 1]:
+                sides = bin(drawn & box_mask).count('1')
+                if sides == 4:
+                    closed += 1
+                elif sides == 3:
+                    offered += 1
+            move = (closed, bit.bit_length() - 1)
+            if closed:
+                captures.append(move)
+            elif offered:
+                unsafe.append(move)
+            else:
+                safe.append(move)
+        captures.sort(reverse=True)
+        return captures + safe + unsafe
+
+    def negamax(self, edges, alpha, beta):
+        """ Returns the margin of a position for the player to move, or a bound of it outside of (alpha, beta).
+
+        Args:
+            edges:  The mask of the lines drawn.
+            alpha:  The margin the player to move is already assured of elsewhere.
+            beta:   The margin above which the opponent will avoid this position.
+
+        """
+        if edges == self.game.all_edges:
+            return 0
+        if self.table is not None:
+            return int(self.table[edges])
+        entry = self.memo.get(edges)
+        if entry is not None:
+            value, bound = entry
+            if bound == EXACT:
+                return value
+            if bound == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value
+
+        original_alpha = alpha
+        best = -len(self.edge_box_masks)
+        for closed, edge in self.ordered_moves(edges):
+            child = edges | (1 << edge)
+            if closed:
+                # Closing a box gives the player another turn
+                value = closed + self.negamax(child, alpha - closed, beta - closed)
+            else:
+                value = -self.negamax(child, -beta, -alpha)
+            if value > best:
+                best = value
+                if best > alpha:
+                    alpha = best
+                    if alpha >= beta:
+                        break
+
+        if best <= original_alpha:
+            self.memo[edges] = (best, UPPER)
+        elif best >= beta:
+            self.memo[edges] = (best, LOWER)
+        else:
+            self.memo[edges] = (best, EXACT)
+        return best
+
+    def solve(self, state):
+        """ Finds a best move of a position.
+
+        Args:
+            state:  The state of the game, which must not be over.
+
+        Returns:    A pair of the margin of the position for the player to move (see EndgameSolver) and a move reaching
+                    it.
+
+        """
+        if self.table is not None:
+            return tablebase.best_move(self.table, state)
+        if len(self.memo) > self.max_entries:
+            self.memo.clear()
+        edges = state.edges
+        bound = len(self.game.box_edges) + 1
+        alpha = -bound
+        best_edge = None
+        for closed, edge in self.ordered_moves(edges):
+            child = edges | (1 << edge)
+            if closed:
+                value = closed + self.negamax(child, alpha - closed, bound - closed)
+            else:
+                value = -self.negamax(child, -bound, -alpha)
+            if value > alpha:
+                alpha = value
+                best_edge = edge
+        return alpha, self.game.moves[best_edge]
+
+
+# One solver per board size, so that the memo tables are kept from one move and one game to the next
+_solvers = {}
+
+
+def get_solver(game):
+    """ Returns the shared EndgameSolver of a game's board size, which uses the board's endgame table if it was built. """
+    solver = _solvers.get(game.width)
+    if solver is None:
+        solver = _solvers[game.width] = EndgameSolver(game, table=tablebase.load(game))
+    else:
+        # The table may have been built (or rebuilt) since the solver was made
+        solver.table = tablebase.load(game)
+    return solver
+
+
+def solve(state):
+    """ Solves a position exactly (see EndgameSolver.solve), which is only practical with a few lines left unless the
+    board's endgame table was built.
+
+    Args:
+        state:  The state of the game, which must not be over.
+
+    Returns:    A pair of the margin of the position for the player to move and a best move.
+
+    """
+    return get_solver(state.game).solve(state)
@@ -0,0 +1,174 @@
+import argparse
+import random
+
+import numpy as np
+
+from p2_game import create_game
+from p2_selfplay import record_state, shard_paths, ShardReader
+from rollout_engine import heuristic_playout
+
+# The features of a state, all from the point of view of the player to move:
+#   bias            1
+#   margin          the boxes owned by the player minus those of the opponent, per box of the board
+#   capturable      the boxes with three sides, which the player can close, per box
+#   two_sided       the boxes with two sides, per box
+#   chains          the chains of boxes with two sides (see p2_game.State.chains), per box
+#   loops           the loops of boxes with two sides, per box
+#   long_chains     the chains of three boxes or more, per box
+#   chain_parity    1 if the long chain rule favours the player (the first player wants the number of dots plus the
+#                   number of long chains to be even), else -1
+#   safe_parity     1 if the number of lines that give no box away is odd, so that the opponent is the first to run out
+#                   of them, else -1
+FEATURES = ('bias', 'margin', 'capturable', 'two_sided', 'chains', 'loops', 'long_chains', 'chain_parity',
+            'safe_parity')
+
+# Weights of the logistic model, fitted with fit() on the 12800 positions of 400 self-play games of mcts_modified
+# against mcts_vanilla (300 iterations each), 200 on a board of width 4 and 200 of width 5
+DEFAULT_WEIGHTS = np.array([0.1325, 7.8062, 1.6499, -0.5999, 0.7457, -0.0239, -0.6934, -0.1744, 0.1106])
+
+
+def features(states):
+    """ Computes the features of a batch of states.
+
+    The counts are gathered from every state (its incrementally kept side masks, and its chains, which are rescanned
+    once per position; see p2_game.State.chains) and turned into features for the whole batch at once with NumPy.
+
+    Args:
+        states: A list of states of the same game.
+
+    Returns:    A (number of states, len(FEATURES)) float array.
+
+    """
+    game = states[0].game
+    counts = np.empty((len(states), 8), dtype=np.int64)
+    for row, state in enumerate(states):
+        chains, loops = state.chains
+        side_masks = state.side_masks
+        counts[row] = (state.turn, state.box_counts[0] - state.box_counts[1], side_masks[3].bit_count(),
+                       side_masks[2].bit_count(), len(chains), len(loops),
+                       sum(1 for chain in chains if chain.bit_count() >= 3), state.safe_edges.bit_count())
+
+    turn, margin, capturable, two_sided, num_chains, num_loops, long_chains, safe = counts.T
+    sign = 1 - 2 * turn
+    num_boxes = len(game.box_cells)
+    first_favoured = (game.width * game.width + long_chains) % 2 == 0
+    return np.column_stack([np.ones(len(states)), sign * margin / num_boxes, capturable / num_boxes,
+                            two_sided / num_boxes, num_chains / num_boxes, num_loops / num_boxes,
+                            long_chains / num_boxes, sign * np.where(first_favoured, 1., -1.),
+                            np.where(safe % 2 == 1, 1., -1.)])
+
+
+def win_probabilities(states, weights=None):
+    """ Returns, for each of a batch of states, the probability that the player to move wins according to the logistic
+    model with the given weights (DEFAULT_WEIGHTS by default).
+    """
+    weights = DEFAULT_WEIGHTS if weights is None else weights
+    return 1. / (1. + np.exp(-features(states) @ weights))
+
+
+class LinearEvaluator:
+    def __init__(self, weights=None, depth=0, rng=None):
+        """ A leaf evaluator (see mcts_batch) scoring states with the logistic model of their features, after an
+        optional short playout. Finished games score 1 for a win and 0 for a loss or a tie, as in a full rollout.
+
+        Args:
+            weights:    The weights of the model, one per feature; by default DEFAULT_WEIGHTS.
+            depth:      The number of moves played from every state before it is evaluated; 0 evaluates the states as
+                        they are.
+            rng:        The random.Random generator of the playouts; by default the random module's.
+
+        """
+        self.weights = DEFAULT_WEIGHTS if weights is None else np.asarray(weights, dtype=float)
+        self.depth = depth
+        self.rng = rng
+
+    def __call__(self, states, identity):
+        if self.depth:
+            for state in states:
+                heuristic_playout(state, self.rng or random, self.depth)
+        results = [1. if state.winner == identity else 0. for state in states]
+        playing = [index for index, state in enumerate(states) if not state.is_terminal()]
+        if playing:
+            wins = win_probabilities([states[index] for index in playing], self.weights)
+            for index, win in zip(playing, wins.tolist()):
+                results[index] = win if states[index].player_turn == identity else 1. - win
+        return results
+
+
+def fit(paths, l2=1e-3, iterations=25, max_positions=None, verbose=True):
+    """ Fits the weights of the logistic model to the outcomes of recorded games, by Newton's method on the
+    L2-regularized log loss. Ties count as half a win.
+
+    Args:
+        paths:          Self-play shards, or a directory holding them (see p2_selfplay).
+        l2:             The weight of the L2 penalty on the weights (other than the bias).
+        iterations:     The maximum number of Newton steps.
+        max_positions:  If given, the number of positions read from the shards.
+        verbose:        Whether to print the log loss of every step.
+
+    Returns:            The array of weights, one per feature.
+
+    """
+    rows, targets = [], []
+    read = 0
+    for path in shard_paths(paths):
+        reader = ShardReader(path)
+        game = create_game(reader.width)
+        for chunk in reader:
+            if max_positions is not None:
+                chunk = chunk[:max_positions - read]
+            rows.append(features([record_state(game, record) for record in chunk]))
+            targets.append((chunk['outcome'] + 1) / 2.)
+            read += len(chunk)
+            if max_positions is not None and read >= max_positions:
+                break
+        reader.close()
+        if max_positions is not None and read >= max_positions:
+            break
+    x = np.concatenate(rows)
+    y = np.concatenate(targets)
+
+    penalty = np.full(len(FEATURES), l2 * len(x))
+    penalty[0] = 0.
+    weights = np.zeros(len(FEATURES))
+    for step in range(iterations):
+        p = 1. / (1. + np.exp(-x @ weights))
+        gradient = x.T @ (p - y) + penalty * weights
+        hessian = (x * (p * (1. - p))[:, None]).T @ x + np.diag(penalty) + 1e-9 * np.eye(len(FEATURES))
+        delta = np.linalg.solve(hessian, gradient)
+        weights -= delta
+        if verbose:
+            eps = 1e-12
+            loss = -np.mean(y * np.log(p + eps) + (1. - y) * np.log(1. - p + eps))
+            print("Step %d: log loss %.4f on %d positions" % (step, loss, len(x)))
+        if np.abs(delta).max() < 1e-6:
+            break
+    return weights
+
+
+def load_weights(path):
+    """ Loads weights saved by the command line of this module, e.g. for LinearEvaluator(load_weights(path)). """
+    weights = np.load(path)
+    if weights.shape != (len(FEATURES),):
+        raise ValueError("%s holds %s weights, not %d" % (path, weights.shape, len(FEATURES)))
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fits the weights of the leaf evaluator to self-play games.")
+    parser.add_argument('data', nargs='+', help="Self-play shards, or directories holding them (see p2_selfplay).")
+    parser.add_argument('--l2', type=float, default=1e-3, help="Weight of the L2 penalty (default 0.001).")
+    parser.add_argument('--max-positions', type=int, help="Number of positions read from the shards (default all).")
+    parser.add_argument('--out', help="File to save the weights to, as a NumPy .npy array.")
+    args = parser.parse_args()
+
+    paths = [path for data in args.data for path in shard_paths(data)]
+    weights = fit(paths, args.l2, max_positions=args.max_positions)
+    for name, weight in zip(FEATURES, weights):
+        print("%-14s %8.4f" % (name, weight))
+    if args.out:
+        np.save(args.out, weights)
+
+
+if __name__ == '__main__':
+    main()
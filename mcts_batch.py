@@ -0,0 +1,129 @@
+
+import importlib
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from mcts_parallel import get_pool
+
+# An evaluator is any callable taking a list of leaf states and the bot's identity, and returning for each state a
+# result in [0, 1] from the bot's point of view (1 for a win). The states are owned by the evaluator, which may play
+# them out in place.
+
+
+class SerialEvaluator:
+    def __init__(self, rollout):
+        """ Evaluates leaves one after another in this process.
+
+        Args:
+            rollout:    The rollout function of a bot, which plays a state out and returns the winner.
+
+        """
+        self.rollout = rollout
+
+    def __call__(self, states, identity):
+        results = []
+        for state in states:
+            results.append(1 if self.rollout(state) == identity else 0)
+        return results
+
+
+class ThreadPoolEvaluator:
+    def __init__(self, rollout, workers=4):
+        """ Evaluates leaves on a pool of threads. This only pays off with rollouts that release the GIL, such as
+        vectorized ones.
+
+        Args:
+            rollout:    The rollout function of a bot, which plays a state out and returns the winner.
+            workers:    The number of threads.
+
+        """
+        self.rollout = rollout
+        self.executor = ThreadPoolExecutor(workers)
+
+    def _evaluate(self, state, identity):
+        return 1 if self.rollout(state) == identity else 0
+
+    def __call__(self, states, identity):
+        return list(self.executor.map(self._evaluate, states, [identity] * len(states)))
+
+
+def _rollout_worker(args):
+    """ Plays a state out with the rollout of a bot in a worker process and returns the result. """
+    bot_name, state, identity, seed = args
+    bot = importlib.import_module(bot_name)
+    # The random module is seeded as well, for the rollout policies drawing from it
+    seeds = random.Random(seed)
+    bot.rng.seed(seeds.getrandbits(32))
+    random.seed(seeds.getrandbits(32))
+    return 1 if bot.rollout(state) == identity else 0
+
+
+class ProcessPoolEvaluator:
+    def __init__(self, bot_name, workers=4, seed=None):
+        """ Evaluates leaves on the shared process pool (see mcts_parallel.get_pool).
+
+        Args:
+            bot_name:   The module name of the bot whose rollout() is used, e.g. 'mcts_vanilla'.
+            workers:    The number of worker processes.
+            seed:       The seed from which the seed of every rollout is drawn, for reproducible evaluations.
+
+        """
+        self.bot_name = bot_name
+        self.workers = workers
+        self.seeds = random.Random(seed)
+
+    def __call__(self, states, identity):
+        pool = get_pool(self.workers)
+        return pool.map(_rollout_worker, [(self.bot_name, state, identity, self.seeds.getrandbits(32))
+                                          for state in states])
+
+
+def batched_search(tree, state, budget, batch_size, traverse_nodes, expand_leaf, evaluator, make_room=None):
+    """ Grows a game tree for the state, selecting and expanding `batch_size` leaves per round before evaluating them
+    all at once. Virtual losses are applied along the path to every selected leaf, so that the leaves of a round spread
+    over the tree, and are taken back when the results are backpropagated.
+
+    Args:
+        tree:           The MCTSTree to grow, rooted at the state.
+        state:          The state of the game.
+        budget:         The mcts_search.SearchBudget deciding when to stop.
+        batch_size:     The number of leaves evaluated together.
+        traverse_nodes: The selection function of a bot.
+        expand_leaf:    The expansion function of a bot.
+        evaluator:      The evaluator of the leaves.
+        make_room:      If given, the function of the bot keeping the tree within its size cap, called between rounds.
+
+    Returns:            The MCTSTree built.
+
+    """
+    identity_of_bot = state.player_turn
+
+    done = 0
+    while not budget.exhausted(tree, done):
+        if make_room is not None:
+            make_room(tree)
+        leaves = []
+        round_size = batch_size if budget.iterations is None else min(batch_size, budget.iterations - done)
+        for step in range(round_size):
+            sampled_game = state.copy()
+            # The root takes a virtual visit too, as it is the parent of the first nodes selected
+            virtual_losses = [tree.add_virtual_loss(0)]
+            # Select
+            leaf = traverse_nodes(tree, 0, sampled_game, identity_of_bot, virtual_losses=virtual_losses)
+            # Expand
+            maximize = sampled_game.player_turn == identity_of_bot
+            node = expand_leaf(tree, leaf, sampled_game)
+            if node != leaf:
+                virtual_losses.append(tree.add_virtual_loss(node, maximize))
+            leaves.append((node, sampled_game, virtual_losses))
+
+        # Evaluate
+        results = evaluator([sampled_game for _, sampled_game, _ in leaves], identity_of_bot)
+
+        # Backpropagate, along the path recorded by the virtual losses
+        for (node, _, virtual_losses), result in zip(leaves, results):
+            tree.remove_virtual_losses(virtual_losses)
+            tree.backpropagate(node, result, [visited for visited, _ in virtual_losses])
+        done += len(leaves)
+
+    return tree
@@ -0,0 +1,250 @@
+from functools import partial
+from time import perf_counter
+
+from endgame import get_solver, solve
+from mcts_batch import batched_search, SerialEvaluator
+from mcts_node import MCTSTree, TranspositionTable
+from mcts_parallel import root_parallel_search
+from mcts_search import SearchBudget
+from move_reduction import reduced_edges
+from opening_book import book_move
+from p2_game import edge_indices
+
+# The search machinery shared by the MCTS bots. Every function takes the bot as its first argument: the bot's module,
+# whose globals hold its settings (num_nodes, explore_faction...), its random number generator `rng`, its `searcher`
+# and its own rollout(state, moves=None). The bots differ only in those.
+
+# The settings search() depends on. The worker processes of a root parallel search keep the globals they had when the
+# shared pool started, so these are sent along with every search, while telemetry and monitor, which only apply to the
+# searches run in this process, are turned off there.
+SEARCH_SETTINGS = ('explore_faction', 'batch_size', 'evaluator', 'table_size', 'prune_moves', 'rave_bias',
+                   'expansion_prior', 'max_nodes', 'evict_nodes')
+
+
+def _no_clock():
+    """ Stands in for perf_counter in searches without telemetry. """
+    return 0.
+
+
+def candidate_edges(bot, state):
+    """ Returns the bitmask of the edge indices of the moves tried from a state: every legal move, or a single
+    representative per class of equivalent moves if the bot's prune_moves is set.
+    """
+    return reduced_edges(state) if bot.prune_moves else state.legal_edges
+
+
+def traverse_nodes(bot, tree, node, state, identity, path=None, virtual_losses=None):
+    """ Traverses the tree until the end criterion are met.
+
+    Args:
+        bot:            The bot searching.
+        tree:           The search tree.
+        node:           The index of a tree node from which the search is traversing.
+        state:          The state of the game.
+        identity:       The bot's identity, either 'red' or 'blue'.
+        path:           If given, a list to which the indices of the traversed nodes are appended.
+        virtual_losses: If given, a list to which the virtual losses applied to the traversed nodes are recorded, for
+                        searches that select several leaves before backpropagating.
+
+    Returns:        The index of a node from which the next stage of the search can proceed.
+
+    """
+    explore_faction = bot.explore_faction
+    rave_bias = bot.rave_bias
+    # Checking to make sure there are no untried actions
+    # and there are still child nodes left
+    while not tree.untried[node] and tree.num_children[node]:
+        # Maximize bot's chances of winning, or the chance of losing on the opponent's turn
+        maximize = state.player_turn == identity
+        node, edge = tree.best_child(node, explore_faction, maximize, rave_bias)
+        if path is not None:
+            path.append(node)
+        if virtual_losses is not None:
+            virtual_losses.append(tree.add_virtual_loss(node, maximize))
+        state.apply_move(state.game.moves[edge])
+    return node
+
+
+def expand_leaf(bot, tree, node, state):
+    """ Adds a new leaf to the tree by creating a new child node for the given node.
+
+    Args:
+        bot:    The bot searching.
+        tree:   The search tree.
+        node:   The index of the node for which a child will be added.
+        state:  The state of the game.
+
+    Returns:    The index of the added child node.
+
+    """
+    new_node = node
+    # Checking to make sure there are still untried actions, and room for another node
+    if tree.untried[node] and not (bot.max_nodes and tree.size >= bot.max_nodes):
+        if bot.expansion_prior is None:
+            # Randomly choose untried action
+            edge = bot.rng.choice(edge_indices(tree.untried[node]))
+        else:
+            edge = bot.expansion_prior(state, tree.untried[node], bot.rng)
+        # Apply the move to the game state
+        state.apply_move(state.game.moves[edge])
+        # Make a new node with the move and the game state (or reuse the node of the same position reached by another
+        # move order), which also removes it from the untried actions
+        new_node = tree.add_child(node, edge, candidate_edges(bot, state), state.hash)
+    return new_node
+
+
+def backpropagate(tree, node, won, path=None):
+    """ Navigates the tree from a leaf node to the root, updating the win and visit count of each node along the path.
+
+    Args:
+        tree:   The search tree.
+        node:   The index of a leaf node.
+        won:    An indicator of whether the bot won or lost the game.
+        path:   The indices of the nodes traversed from the root to the leaf, needed with a transposition table.
+
+    """
+    tree.backpropagate(node, won, path)
+
+
+def make_room(bot, tree):
+    """ Evicts the least visited nodes of a full tree if the bot's evict_nodes is set. It is called between two
+    iterations of a search, while no node index is held.
+    """
+    if bot.evict_nodes and bot.max_nodes and tree.size >= bot.max_nodes:
+        tree.evict(bot.max_nodes // 2)
+
+
+def search(bot, state, iterations, tree=None, deadline=None):
+    """ Builds a game tree for the state by sampling games and calling the appropriate functions. The search stops
+    early once the most visited move at the root cannot be overtaken anymore.
+
+    Args:
+        bot:        The bot searching.
+        state:      The state of the game.
+        iterations: The maximum number of games to sample, or None to sample until the deadline.
+        tree:       A tree rooted at the state to keep growing, e.g. from a previous search; by default a new one.
+        deadline:   The time.monotonic() time at which to stop sampling, or None to sample `iterations` games.
+
+    Returns:        The MCTSTree built.
+
+    """
+    if tree is None:
+        table = TranspositionTable(bot.table_size) if bot.table_size else None
+        tree = MCTSTree(state.game, candidate_edges(bot, state), table=table, root_key=state.hash)
+
+    budget = SearchBudget(iterations, deadline, monitor=bot.monitor)
+
+    if bot.batch_size > 1 or bot.evaluator is not None:
+        return batched_search(tree, state, budget, bot.batch_size, partial(traverse_nodes, bot),
+                              partial(expand_leaf, bot), bot.evaluator or SerialEvaluator(bot.rollout),
+                              partial(make_room, bot))
+    rave = bot.rave_bias is not None
+    identity_of_bot = state.player_turn
+
+    # With telemetry, the time of every phase is recorded; otherwise the clock is a no-op
+    recorder = bot.telemetry.start(tree, state) if bot.telemetry is not None else None
+    clock = perf_counter if recorder is not None else _no_clock
+
+    # A single copy of the game is used for sampling every playthrough; the moves of each playthrough are taken back
+    # once its result has been backpropagated.
+    copy_start = clock()
+    sampled_game = state.copy()
+    start_ply = len(sampled_game.history)
+    if recorder is not None:
+        recorder.phases['copy'] += clock() - copy_start
+
+    step = 0
+    while not budget.exhausted(tree, step):
+        t0 = clock()
+        make_room(bot, tree)
+        t1 = clock()
+        # Start at root
+        node = 0
+        path = [node]
+        # Do MCTS - This is all you!
+        # Select
+        v1 = traverse_nodes(bot, tree, node, sampled_game, identity_of_bot, path)
+        t2 = clock()
+        # Expand
+        delta = expand_leaf(bot, tree, v1, sampled_game)
+        if delta != v1:
+            path.append(delta)
+        t3 = clock()
+        # Rollout
+        moves = [] if rave else None
+        leaf_ply = len(sampled_game.history)
+        lines_left = sampled_game.legal_edges
+        winner = bot.rollout(sampled_game, moves)
+        t4 = clock()
+        # Iterator for backpropogate and win
+        result = 0
+        if identity_of_bot == winner:
+            result = 1
+        backpropagate(tree, delta, result, path)
+        if moves is not None:
+            # All moves as first: the moves of the path, then those of the rollout
+            played = [(edge, turn) for edge, turn, _, _ in sampled_game.history[start_ply:leaf_ply]]
+            tree.update_amaf(path, played + moves, result)
+        t5 = clock()
+
+        # Rewind the sampled game to the root position
+        sampled_game.rewind(start_ply)
+        if recorder is not None:
+            recorder.add_iteration((t0, t1, t2, t3, t4, t5, clock()), len(path) - 1, lines_left)
+        step += 1
+
+    if recorder is not None:
+        recorder.finish(tree, step)
+    return tree
+
+
+def think(bot, state, deadline=None, iterations=None):
+    """ Performs MCTS by sampling games and calling the appropriate functions to construct the game tree.
+
+    Args:
+        bot:        The bot thinking.
+        state:      The state of the game.
+        deadline:   The time.monotonic() time by which to answer, or None to run a fixed number of iterations.
+        iterations: The maximum number of iterations; by default the bot's num_nodes, or unlimited if a deadline is
+                    given.
+
+    Returns:        The action to be taken.
+
+    """
+    legal_moves = state.legal_moves
+    if len(legal_moves) == 1:
+        return legal_moves[0]
+    if bot.use_book:
+        move = book_move(state)
+        if move is not None:
+            return move
+    if bot.prune_moves:
+        candidates = reduced_edges(state)
+        if not candidates & (candidates - 1):
+            # A forced capture, or a position where all moves are equivalent
+            return state.game.moves[candidates.bit_length() - 1]
+    if len(legal_moves) <= bot.endgame_lines or (bot.use_tablebase and get_solver(state.game).table is not None):
+        # Few enough lines are left for the endgame to be solved, or the position is in the table: play a proven best
+        # move
+        return solve(state)[1]
+    if iterations is None and deadline is None:
+        iterations = bot.num_nodes
+
+    if bot.num_workers > 1:
+        # Root parallelization: independent trees are grown in worker processes and their root statistics summed
+        if iterations is not None and not bot.split_nodes:
+            iterations *= bot.num_workers
+        settings = {name: getattr(bot, name) for name in SEARCH_SETTINGS}
+        settings.update(telemetry=None, monitor=None)
+        totals = root_parallel_search(bot.__name__, state, bot.num_workers, iterations, settings,
+                                      bot.rng.getrandbits(32), deadline)
+        return state.game.moves[max(totals, key=lambda action: totals[action][1])]
+
+    if bot.reuse_tree:
+        tree = bot.searcher.search(state, iterations, deadline)
+    else:
+        tree = search(bot, state, iterations, deadline=deadline)
+
+    # Return an action, typically the most frequently used action (from the root) or the action with the best
+    # estimated win rate
+    return state.game.moves[tree.most_visited_child(0)[1]]
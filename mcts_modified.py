@@ -2,205 +2,96 @@
 # Joseph Rossi
 # CMPM146 P2
 
-from mcts_node import MCTSNode
-from random import choice
-from math import sqrt, log
+import sys
+from random import Random
 
+import mcts_core
+from mcts_search import Searcher
+from priors import safe_first
+from rollout_engine import heuristic_playout
+
+rng = Random()          # Random number generator of the search; seed it for reproducible searches
 num_nodes = 100
 explore_faction = 0.3
-
-
-def traverse_nodes(node, state, identity):
-    """ Traverses the tree until the end criterion are met.
+num_workers = 1         # Number of processes searching in parallel from the root; 1 searches in this process
+split_nodes = True      # Whether num_nodes is split among the workers, or run by every one of them
+batch_size = 1          # Number of leaves selected (with virtual loss) and evaluated together per round
+evaluator = None        # Evaluator of the selected leaves; None plays them out one by one with rollout(),
+                        # rollout_engine.VectorizedEvaluator() plays them all out together with NumPy and
+                        # evaluation.LinearEvaluator() scores them with a static evaluation after a short playout
+table_size = 0          # Number of entries of the transposition table sharing nodes between move orders; 0 for none
+reuse_tree = True       # Whether the part of the last tree below the position reached is reused by the next search
+telemetry = None        # mcts_telemetry.Telemetry recording the phase times and tree statistics of every search; None
+                        # runs the search loop uninstrumented
+endgame_lines = 0       # Number of lines left at or below which think() solves the game exactly instead of searching;
+                        # 0 never solves
+prune_moves = True      # Whether nodes only try one move per class of equivalent moves (see move_reduction)
+use_tablebase = False   # Whether think() plays every move from the board's endgame table, if one was built (see
+                        # tablebase)
+use_book = False        # Whether think() plays from the board's opening book, if it was built (see opening_book)
+monitor = None          # Function called every few iterations of a search as monitor(tree, completed), e.g. to show
+                        # progress; returning True stops the search (see mcts_search.SearchBudget)
+rave_bias = 0.05        # Bias b of the blending of the children's all-moves-as-first win rates into their own, with
+                        # weight ñ / (n + ñ + 4b²nñ) for n visits and ñ AMAF visits; None disables RAVE
+expansion_prior = safe_first  # Function choosing the untried move to expand, as prior(state, untried, rng)
+                              # (see priors); None picks one at random
+max_nodes = 0           # Cap on the number of nodes of the tree; 0 for none
+evict_nodes = True      # Whether a search that fills the tree evicts its least visited nodes, down to half of max_nodes,
+                        # or stops expanding and only refines the nodes it has
+
+
+def rollout(state, moves=None):
+    """ Given the state of the game, the rollout plays out the remainder with a simple strategy: close a box whenever
+    one has three sides, otherwise draw a random line that gives no box away, and only when there is none left, any
+    random line (see rollout_engine.heuristic_playout).
 
     Args:
-        node:       A tree node from which the search is traversing.
-        state:      The state of the game.
-        identity:   The bot's identity, either 'red' or 'blue'.
+        state:  The state of the game.
+        moves:  If given, a list to which the (edge index, player index) of every move of the rollout is appended.
 
-    Returns:        A node from which the next stage of the search can proceed.
+    Returns:    The winner of the game played out, or 'tie'.
 
     """
+    ply = len(state.history)
+    heuristic_playout(state, rng)
 
-    child_values = node.child_nodes.values()
-    # Checking to make sure there are no untried actions
-    # and there are still child nodes left
-    while node.untried_actions == [] and len(child_values) != 0:
-        if state.player_turn == identity:
-            # Maximize bot's chances of winning
-            node = max(child_values, key=lambda c: (c.wins / c.visits)
-                                                   + explore_faction * sqrt(2 * log(c.parent.visits) / c.visits))
-        else:
-            # Maximize bot's chance of losing
-            node = max(child_values, key=lambda c: (1 - (c.wins / c.visits)
-                                                    + explore_faction * sqrt(2 * log(c.parent.visits) / c.visits)))
-        state.apply_move(node.parent_action)
-        child_values = node.child_nodes.values()
-    return node
-
-    pass
-    # Hint: return leaf_node
-
-
-def expand_leaf(node, state):
-    """ Adds a new leaf to the tree by creating a new child node for the given node.
-
-    Args:
-        node:   The node for which a child will be added.
-        state:  The state of the game.
-
-    Returns:    The added child node.
+    if moves is not None:
+        moves.extend((edge, turn) for edge, turn, _, _ in state.history[ply:])
+    return state.winner
 
-    """
-    new_node = node
-    # Checking to make sure there are still untried actions
-    if node.untried_actions:
-        # Randomly choose untried action
-        move = choice(node.untried_actions)
-        # Apply the move to the game state
-        state.apply_move(move)
-        # Make a new node with the move and the game state
-        new_node = MCTSNode(node, move, state.legal_moves)
-        # Append the new node to the tree
-        node.child_nodes[move] = new_node
-        # Remove the action from the list of untried actions
-        node.untried_actions.remove(move)
-    return new_node
-    pass
-    # Hint: return new_node
-
-
-def rollout(state):
-    """ Given the state of the game, the rollout plays out the remainder randomly.
 
-    Args:
-        state:  The state of the game.
+# The search itself is shared by the MCTS bots (see mcts_core); it reads this bot's settings from the globals above
+_bot = sys.modules[__name__]
 
-    """
 
-    # List for coordinates that make a box for the other player to close
-    dont_go = []
-
-    # Copy of legal moves
-    moves = state.legal_moves
-
-    # Heuristic to complete horse-shoe shape if possible
-    for i in range(0, 3):
-        for j in range(0, 3):
-            # n shape
-            if (i, j) in state.h_line_owners \
-                    and (i, j) in state.v_line_owners \
-                    and (i + 1, j) in state.v_line_owners:
-                state.apply_move(('h', (i, j + 1)))
-                return
-            # [ shape
-            elif (i, j) in state.h_line_owners \
-                    and (i, j) in state.v_line_owners \
-                    and (i, j + 1) in state.v_line_owners:
-                state.apply_move(('v', (i + 1, j)))
-                return
-            # ] shape
-            elif (i, j) in state.h_line_owners \
-                    and (i + 1, j) in state.v_line_owners \
-                    and (i + 1, j + 1) in state.v_line_owners:
-                state.apply_move(('v', (i, j)))
-                return
-            # U shape
-            elif (i, j + 1) in state.h_line_owners \
-                    and (i + 1, j) in state.v_line_owners \
-                    and (i, j) in state.v_line_owners:
-                state.apply_move(('h', (i, j)))
-                return
-
-            # Heuristic to check to not make a box for the other player to close
-            if (i, j) in state.h_line_owners:
-                if (i, j) in state.v_line_owners:
-                    dont_go.append(('h', (i + 1, j)))
-                    dont_go.append(('v', (i, j + 1)))
-                if (i, j + 1) in state.h_line_owners:
-                    dont_go.append(('v', (i, j)))
-                    dont_go.append(('v', (i + 1, j)))
-            elif (i + 1, j) in state.v_line_owners:
-                if (i, j + 1) in state.h_line_owners:
-                    dont_go.append(('h', (i, j)))
-                    dont_go.append(('v', (i, j)))
-                if (i, j) in state.v_line_owners:
-                    dont_go.append(('h', (i, j)))
-                    dont_go.append(('h', (i, j + 1)))
-            elif (i + 1, j) in state.h_line_owners \
-                    and (i, j) in state.v_line_owners:
-                dont_go.append(('h', (i, j)))
-                dont_go.append(('v', (i + 1, j)))
-            elif (i, j) in state.h_line_owners \
-                    and (i + 1, j) in state.v_line_owners:
-                dont_go.append(('v', (i, j)))
-                dont_go.append(('h', (i, j + 1)))
-
-    # Checking to make sure there are still moves left
-    while not state.is_terminal():
-        # Choose a random move
-        m = choice(state.legal_moves)
-        # Check to see if move is in don't go
-        if m in dont_go:
-            # Choose another move
-            m = choice(state.legal_moves)
-            state.apply_move(m)
-        # If it is among only possible moves left, do it anyways
-        else:
-            state.apply_move(m)
-
-    pass
-
-
-def backpropagate(node, won):
-    """ Navigates the tree from a leaf node to the root, updating the win and visit count of each node along the path.
+def search(state, iterations, tree=None, deadline=None):
+    """ Builds a game tree for the state with this bot's settings (see mcts_core.search).
 
     Args:
-        node:   A leaf node.
-        won:    An indicator of whether the bot won or lost the game.
+        state:      The state of the game.
+        iterations: The maximum number of games to sample, or None to sample until the deadline.
+        tree:       A tree rooted at the state to keep growing, e.g. from a previous search; by default a new one.
+        deadline:   The time.monotonic() time at which to stop sampling, or None to sample `iterations` games.
+
+    Returns:        The MCTSTree built.
 
     """
+    return mcts_core.search(_bot, state, iterations, tree, deadline)
+
 
-    while node:
-        # Increment the number of wins if the bot won
-        node.wins += won
-        # Increment the number of visits
-        node.visits += 1
-        # Trace back on the tree
-        node = node.parent
-    pass
+# Keeps the last tree between calls to think()
+searcher = Searcher(search)
 
 
-def think(state):
-    """ Performs MCTS by sampling games and calling the appropriate functions to construct the game tree.
+def think(state, deadline=None, iterations=None):
+    """ Performs MCTS with this bot's settings (see mcts_core.think).
 
     Args:
-        state:  The state of the game.
+        state:      The state of the game.
+        deadline:   The time.monotonic() time by which to answer, or None to run a fixed number of iterations.
+        iterations: The maximum number of iterations; by default num_nodes, or unlimited if a deadline is given.
 
-    Returns:    The action to be taken.
+    Returns:        The action to be taken.
 
     """
-    identity_of_bot = state.player_turn
-    root_node = MCTSNode(parent=None, parent_action=None, action_list=state.legal_moves)
-
-    for step in range(num_nodes):
-        # Copy the game for sampling a playthrough
-        sampled_game = state.copy()
-        # Start at root
-        node = root_node
-        # Do MCTS - This is all you!
-        # Select
-        v1 = traverse_nodes(node, sampled_game, identity_of_bot)
-        # Expand
-        delta = expand_leaf(v1, sampled_game)
-        # Rollout
-        rollout(sampled_game)
-        # Iterator for backpropogate and win
-        result = 0
-        if identity_of_bot == sampled_game.winner:
-            result = 1
-        backpropagate(delta, result)
-
-    # Return an action, typically the most frequently used action (from the root) or the action with the best
-    # estimated win rate
-    return max(root_node.child_nodes.values(), key=lambda c: c.visits).parent_action
+    return mcts_core.think(_bot, state, deadline, iterations)
@@ -1,24 +1,453 @@
 
+import heapq
+import sys
+
+import numpy as np
+from math import log
+
+
+class TranspositionTable:
+    def __init__(self, size):
+        """ Initializes a fixed-size table mapping the Zobrist hashes of positions to the tree nodes searching them.
+
+        The table is split in buckets of two entries, selected by the hash. When a bucket is full, a new position
+        replaces the entry whose node has the fewest visits, so that the most searched positions stay shared.
+
+        Args:
+            size:   The number of entries of the table.
+
+        """
+        self.num_buckets = max(1, size // 2)
+        self.keys = np.zeros(2 * self.num_buckets, dtype=np.uint64)
+        self.nodes = np.full(2 * self.num_buckets, -1, dtype=np.int32)
+
+    def lookup(self, key):
+        """ Returns the index of the node stored for a hash, or -1 if there is none. """
+        slot = 2 * (key % self.num_buckets)
+        for entry in (slot, slot + 1):
+            if self.nodes[entry] >= 0 and int(self.keys[entry]) == key:
+                return int(self.nodes[entry])
+        return -1
+
+    def store(self, key, node, visits):
+        """ Stores the node searching the position with the given hash.
+
+        Args:
+            key:    The Zobrist hash of the position.
+            node:   The index of the node.
+            visits: The visit counts of the tree's nodes, to choose which entry to replace in a full bucket.
+
+        """
+        slot = 2 * (key % self.num_buckets)
+        if self.nodes[slot] < 0:
+            entry = slot
+        elif self.nodes[slot + 1] < 0:
+            entry = slot + 1
+        else:
+            entry = slot if visits[self.nodes[slot]] <= visits[self.nodes[slot + 1]] else slot + 1
+        self.keys[entry] = key
+        self.nodes[entry] = node
+
+
+class MCTSTree:
+    def __init__(self, game, root_actions, chunk_size=4096, table=None, root_key=0):
+        """ Initializes an MCTS search tree whose nodes are stored in flat NumPy arrays rather than as objects.
+
+        Every node is an index into the node arrays, node 0 being the root. Actions are stored as edge indices of the
+        game (see p2_game.create_game). The children of a node occupy a contiguous block of the `children` array, which
+        is reserved the first time the node is expanded with room for all of its legal actions. Untried actions are
+        kept per node as a bitmask over the edge indices. All arrays grow by `chunk_size` entries when they fill up.
+
+        With a transposition table, a position reached by several move orders is searched by a single node, which then
+        has several parents and makes the tree a directed acyclic graph. The `parent` of such a node is the one it was
+        first reached from, and results must be backpropagated along the path actually traversed.
+
+        For RAVE, every node also keeps all-moves-as-first (AMAF) statistics: the results of the playouts through its
+        parent in which the node's action was played later on by the same player (see update_amaf).
+
+        Args:
+            game:           The game the tree is searching.
+            root_actions:   The bitmask of the legal actions at the root.
+            chunk_size:     The number of entries by which the arrays grow.
+            table:          An optional TranspositionTable in which the nodes are stored by position.
+            root_key:       The Zobrist hash of the root position.
+
+        """
+        self.game = game
+        self.chunk_size = chunk_size
+
+        self.size = 0                                           # Number of nodes in the tree
+        self.wins = np.zeros(chunk_size, dtype=np.float64)      # Total wins of all paths through a node
+        self.visits = np.zeros(chunk_size, dtype=np.int32)      # Number of times a node has been visited
+        self.parent = np.zeros(chunk_size, dtype=np.int32)      # Parent node index, -1 for the root
+        self.action = np.zeros(chunk_size, dtype=np.int16)      # Edge index leading to a node, -1 for the root
+        self.first_child = np.zeros(chunk_size, dtype=np.int32)  # Start of a node's block in `children`, -1 if none
+        self.num_children = np.zeros(chunk_size, dtype=np.int16)  # Number of children added to a node's block
+        self.key = np.zeros(chunk_size, dtype=np.uint64)        # Zobrist hash of a node's position
+        self.amaf_wins = np.zeros(chunk_size, dtype=np.float64)  # Total wins of the AMAF playouts of a node
+        self.amaf_visits = np.zeros(chunk_size, dtype=np.int32)  # Number of AMAF playouts of a node
+        self.untried = []                                       # Bitmask of a node's yet unexplored actions
+
+        self.used_slots = 0                                     # Number of reserved entries of `children`
+        self.children = np.zeros(chunk_size, dtype=np.int32)    # Child node indices, in per-node blocks
+        self.child_actions = np.zeros(chunk_size, dtype=np.int16)  # Edge index leading to the child in each entry
+
+        self.table = table
+        self.add_node(-1, -1, root_actions, root_key)
+
+    def _grow_nodes(self):
+        extra = self.chunk_size
+        for name in ('wins', 'visits', 'parent', 'action', 'first_child', 'num_children', 'key', 'amaf_wins',
+                     'amaf_visits'):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate((array, np.zeros(extra, dtype=array.dtype))))
+
+    def _reserve_children(self, count):
+        start = self.used_slots
+        while start + count > len(self.children):
+            self.children = np.concatenate((self.children, np.zeros(self.chunk_size, dtype=np.int32)))
+            self.child_actions = np.concatenate((self.child_actions, np.zeros(self.chunk_size, dtype=np.int16)))
+        self.used_slots += count
+        return start
+
+    def add_node(self, parent, action, untried, key=0):
+        """ Appends a node to the tree without linking it to its parent's children.
+
+        Args:
+            parent:     The index of the parent node, -1 for the root.
+            action:     The edge index of the action leading to the node, -1 for the root.
+            untried:    The bitmask of the legal actions at the node.
+            key:        The Zobrist hash of the node's position, under which it is stored in the transposition table.
+
+        Returns:        The index of the new node.
+
+        """
+        node = self.size
+        if node == len(self.wins):
+            self._grow_nodes()
+        self.size += 1
+        self.wins[node] = 0
+        self.visits[node] = 0
+        self.parent[node] = parent
+        self.action[node] = action
+        self.first_child[node] = -1
+        self.num_children[node] = 0
+        self.key[node] = key
+        self.amaf_wins[node] = 0
+        self.amaf_visits[node] = 0
+        self.untried.append(untried)
+        if self.table is not None:
+            self.table.store(key, node, self.visits)
+        return node
+
+    def add_child(self, node, action, untried, key=0):
+        """ Creates the child of a node reached by one of its untried actions. With a transposition table, a node
+        already searching the resulting position is linked as the child instead.
+
+        Args:
+            node:       The index of the node being expanded.
+            action:     The edge index of an untried action of the node.
+            untried:    The bitmask of the legal actions at the new child.
+            key:        The Zobrist hash of the position of the new child.
+
+        Returns:        The index of the new child.
+
+        """
+        if self.first_child[node] < 0:
+            self.first_child[node] = self._reserve_children(self.untried[node].bit_count())
+        child = self.table.lookup(key) if self.table is not None else -1
+        if child < 0:
+            child = self.add_node(node, action, untried, key)
+        slot = self.first_child[node] + self.num_children[node]
+        self.children[slot] = child
+        self.child_actions[slot] = action
+        self.num_children[node] += 1
+        self.untried[node] &= ~(1 << action)
+        return child
+
+    def child_indices(self, node):
+        """ Returns the array of child node indices of a node. """
+        start = self.first_child[node]
+        if start < 0:
+            return self.children[:0]
+        return self.children[start:start + self.num_children[node]]
+
+    def child_edges(self, node):
+        """ Returns the array of the edge indices leading from a node to each of its children. """
+        start = self.first_child[node]
+        if start < 0:
+            return self.child_actions[:0]
+        return self.child_actions[start:start + self.num_children[node]]
+
+    def best_child(self, node, explore_faction, maximize=True, rave_bias=None):
+        """ Selects the child of a node with the highest UCB1 value, computed for all children at once.
+
+        With RAVE, the win rate of every child is blended with its AMAF win rate, the weight of the latter being
+        β = ñ / (n + ñ + 4b²nñ) for n visits and ñ AMAF visits: it dominates while the child has few visits of its own
+        and fades as they add up, the faster the larger the bias b.
+
+        Args:
+            node:               The index of a node that has at least one child.
+            explore_faction:    The weight of the exploration term.
+            maximize:           Whether the player choosing at the node wants to maximize the wins (the bot) or to
+                                minimize them (the opponent).
+            rave_bias:          The bias b of the RAVE blending, or None to rank the children by their own win rates.
+
+        Returns:                The index of the selected child and the edge index of the action leading to it.
+
+        """
+        children = self.child_indices(node)
+        visits = self.visits[children]
+        win_rates = self.wins[children] / visits
+        if rave_bias is not None:
+            amaf_visits = self.amaf_visits[children]
+            amaf_rates = self.amaf_wins[children] / np.maximum(amaf_visits, 1)
+            beta = amaf_visits / (visits + amaf_visits + 4 * rave_bias * rave_bias * visits * amaf_visits)
+            win_rates = (1 - beta) * win_rates + beta * amaf_rates
+        if not maximize:
+            win_rates = 1 - win_rates
+        ucb = win_rates + explore_faction * np.sqrt(2 * log(self.visits[node]) / visits)
+        best = np.argmax(ucb)
+        return int(children[best]), int(self.child_edges(node)[best])
+
+    def most_visited_child(self, node):
+        """ Returns the index of the child of a node with the most visits and the edge index leading to it. """
+        children = self.child_indices(node)
+        best = np.argmax(self.visits[children])
+        return int(children[best]), int(self.child_edges(node)[best])
+
+    def best_rate_child(self, node):
+        """ Returns the index of the child of a node with the best win rate and the edge index leading to it. """
+        children = self.child_indices(node)
+        best = np.argmax(self.wins[children] / self.visits[children])
+        return int(children[best]), int(self.child_edges(node)[best])
+
+    def backpropagate(self, node, won, path=None):
+        """ Adds a result to the win and visit counts of a node and all of its ancestors.
+
+        Args:
+            node:   The index of a node.
+            won:    An indicator of whether the bot won or lost the game.
+            path:   The indices of the nodes traversed from the root to the node. It is required with a transposition
+                    table, where a node may have several parents; otherwise the parent links are followed.
+
+        """
+        if path is None:
+            path = []
+            parent = self.parent
+            while node >= 0:
+                path.append(node)
+                node = parent[node]
+        self.wins[path] += won
+        self.visits[path] += 1
+
+    def update_amaf(self, path, moves, won):
+        """ Adds the result of a playout to the AMAF statistics of the children of the nodes along its path.
+
+        A child of a node on the path is updated if its action was played, by the player to move at the node, at any
+        point of the playout after the node: further down the path or in the rollout.
+
+        Args:
+            path:   The indices of the nodes traversed from the root to the leaf.
+            moves:  The (edge index, player index) pairs of all the moves of the playout from the root, those of the
+                    path followed by those of the rollout.
+            won:    An indicator of whether the bot won or lost the game.
+
+        """
+        if not moves:
+            return
+        edges, turns = np.array(moves).T
+        played = np.zeros(len(self.game.moves), dtype=bool)
+        for depth, node in enumerate(path[:len(edges)]):
+            if not self.num_children[node]:
+                continue
+            played[:] = False
+            played[edges[depth:][turns[depth:] == turns[depth]]] = True
+            children = self.child_indices(node)[played[self.child_edges(node)]]
+            self.amaf_wins[children] += won
+            self.amaf_visits[children] += 1
+
+    def find_child(self, node, action):
+        """ Returns the index of the child of a node reached by an action (an edge index), or -1 if it is not in the tree.
+        """
+        found = np.flatnonzero(self.child_edges(node) == action)
+        return int(self.child_indices(node)[found[0]]) if len(found) else -1
+
+    def subtree(self, root, keep=None):
+        """ Copies the part of the tree below a node into a new, compact tree rooted at that node. The rest of the tree
+        is left out, so that it is freed along with this tree.
+
+        Args:
+            root:   The index of the node to become the root.
+            keep:   If given, the set of the nodes to copy, which must include the root and the parent of every node in
+                    it. The actions leading to the children left out become untried again.
+
+        Returns:    The new MCTSTree, with the statistics of the copied nodes.
+
+        """
+        table = TranspositionTable(len(self.table.nodes)) if self.table is not None else None
+        tree = MCTSTree(self.game, self.untried[root], self.chunk_size, table, int(self.key[root]))
+        new_index = {root: 0}
+        order = [root]
+        # Nodes are copied breadth first; a node shared by several parents is copied once, under the first one met.
+        for node in order:
+            new_node = new_index[node]
+            tree.wins[new_node] = self.wins[node]
+            tree.visits[new_node] = self.visits[node]
+            tree.amaf_wins[new_node] = self.amaf_wins[node]
+            tree.amaf_visits[new_node] = self.amaf_visits[node]
+            children = list(zip(self.child_indices(node).tolist(), self.child_edges(node).tolist()))
+            if keep is not None:
+                for child, edge in children:
+                    if child not in keep:
+                        tree.untried[new_node] |= 1 << edge
+                children = [(child, edge) for child, edge in children if child in keep]
+            if not children:
+                continue
+            start = tree._reserve_children(len(children) + tree.untried[new_node].bit_count())
+            tree.first_child[new_node] = start
+            tree.num_children[new_node] = len(children)
+            for slot, (child, edge) in enumerate(children):
+                if child not in new_index:
+                    new_index[child] = tree.add_node(new_node, edge, self.untried[child], int(self.key[child]))
+                    order.append(child)
+                tree.children[start + slot] = new_index[child]
+                tree.child_actions[start + slot] = edge
+        return tree
+
+    def evict(self, target):
+        """ Shrinks the tree in place to its `target` most visited nodes, keeping it connected to the root. As the
+        visits of a node are at least those of its children, the nodes evicted are the least visited ones, far from the
+        root. Their results are already counted in the statistics of their ancestors, and the actions leading to them
+        become untried again, so that they can be expanded anew.
+
+        Node indices from before the eviction are no longer valid.
+
+        Args:
+            target: The number of nodes to keep.
+
+        Returns:    The number of nodes evicted.
+
+        """
+        if self.size <= target:
+            return 0
+        keep = {0}
+        frontier = [(-int(self.visits[child]), child) for child in self.child_indices(0).tolist()]
+        heapq.heapify(frontier)
+        while frontier and len(keep) < target:
+            _, node = heapq.heappop(frontier)
+            if node in keep:
+                continue
+            keep.add(node)
+            for child in self.child_indices(node).tolist():
+                if child not in keep:
+                    heapq.heappush(frontier, (-int(self.visits[child]), child))
+        size = self.size
+        self.__dict__.update(self.subtree(0, keep).__dict__)
+        return size - self.size
+
+    @property
+    def nbytes(self):
+        """ An estimate of the memory used by the tree, in bytes, including its transposition table. """
+        arrays = (self.wins, self.visits, self.parent, self.action, self.first_child, self.num_children, self.key,
+                  self.amaf_wins, self.amaf_visits, self.children, self.child_actions)
+        total = sum(array.nbytes for array in arrays)
+        total += sys.getsizeof(self.untried) + sum(map(sys.getsizeof, self.untried))
+        if self.table is not None:
+            total += self.table.keys.nbytes + self.table.nodes.nbytes
+        return total
+
+    def add_virtual_loss(self, node, maximize=True):
+        """ Counts a pending visit of a node as a loss for the player choosing it, so that the selection of further
+        leaves before the pending result comes in is steered towards other paths.
+
+        Args:
+            node:       The index of a node on the path of a pending playout.
+            maximize:   Whether the player choosing the node is the bot (a loss counts no win) or the opponent (a loss
+                        for the opponent counts as a win for the bot).
+
+        Returns:        A record of the virtual loss, to be handed to remove_virtual_losses.
+
+        """
+        loss = 0.0 if maximize else 1.0
+        self.visits[node] += 1
+        self.wins[node] += loss
+        return node, loss
+
+    def remove_virtual_losses(self, records):
+        """ Takes back the virtual losses recorded by add_virtual_loss. """
+        for node, loss in records:
+            self.visits[node] -= 1
+            self.wins[node] -= loss
+
+    def move(self, node):
+        """ Returns the move leading to a node, None for the root. """
+        action = self.action[node]
+        return self.game.moves[action] if action >= 0 else None
+
+    def node(self, index=0):
+        """ Returns an MCTSNode view of a node of the tree, the root by default. """
+        return MCTSNode(self, index)
+
 
 class MCTSNode:
-    def __init__(self, parent=None, parent_action=None, action_list=[]):
-        """ Initializes the tree node for MCTS. The node stores links to other nodes in the tree (parent and child
-        nodes), as well as keeps track of the number of wins and total simulations that have visited the node.
+    def __init__(self, tree, index=0):
+        """ A read-only view of one node of an MCTSTree, for debugging and printing. It exposes the node the way the
+        search tree used to be represented: links to the parent and child nodes, the untried actions and the number of
+        wins and total simulations that have visited the node.
 
         Args:
-            parent:         The parent node of this node.
-            parent_action:  The action taken from the parent node that transitions the state to this node.
-            action_list:    The list of legal actions to be considered at this node.
+            tree:   The MCTSTree holding the node.
+            index:  The index of the node in the tree.
 
         """
-        self.parent = parent                    # Parent node to this node
-        self.parent_action = parent_action      # The move that got us to this node - "None" for the root node.
+        self.tree = tree
+        self.index = index
+
+    @property
+    def parent(self):
+        """ The parent node of this node. """
+        parent = self.tree.parent[self.index]
+        return MCTSNode(self.tree, int(parent)) if parent >= 0 else None
+
+    @property
+    def parent_action(self):
+        """ The move that got us to this node - "None" for the root node. """
+        return self.tree.move(self.index)
+
+    @property
+    def child_nodes(self):
+        """ Action -> MCTSNode dictionary of children. """
+        moves = self.tree.game.moves
+        return {moves[edge]: MCTSNode(self.tree, int(child))
+                for child, edge in zip(self.tree.child_indices(self.index), self.tree.child_edges(self.index))}
+
+    @property
+    def untried_actions(self):
+        """ Yet unexplored actions. """
+        moves = self.tree.game.moves
+        untried = self.tree.untried[self.index]
+        return [moves[edge] for edge in range(untried.bit_length()) if (untried >> edge) & 1]
+
+    @property
+    def wins(self):
+        """ Total wins of all paths through this node. """
+        return float(self.tree.wins[self.index])
+
+    @property
+    def visits(self):
+        """ Number of times this node has been visited. """
+        return int(self.tree.visits[self.index])
 
-        self.child_nodes = {}                   # Action -> MCTSNode dictionary of children
-        self.untried_actions = action_list      # Yet unexplored actions
+    @property
+    def amaf_wins(self):
+        """ Total wins of the all-moves-as-first playouts of this node. """
+        return float(self.tree.amaf_wins[self.index])
 
-        self.wins = 0                           # Total wins of all paths through this node.
-        self.visits = 0                         # Number of times this node has been visited.
+    @property
+    def amaf_visits(self):
+        """ Number of all-moves-as-first playouts of this node. """
+        return int(self.tree.amaf_visits[self.index])
 
     def __repr__(self):
         """
@@ -0,0 +1,114 @@
+
+import atexit
+import importlib
+import random
+from multiprocessing import Pool
+
+# The pool is kept alive between calls to root_parallel_search, so that the cost of starting the worker processes is
+# only paid once rather than on every move.
+_pool = None
+_pool_size = 0
+
+
+def get_pool(workers):
+    """ Returns the shared process pool, (re)creating it if it does not have the requested number of workers.
+
+    Args:
+        workers:    The number of worker processes.
+
+    Returns:        A multiprocessing.Pool.
+
+    """
+    global _pool, _pool_size
+    if _pool is None or _pool_size != workers:
+        close_pool()
+        _pool = Pool(workers)
+        _pool_size = workers
+    return _pool
+
+
+def close_pool():
+    """ Shuts the shared process pool down, if it is running. """
+    global _pool, _pool_size
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+        _pool_size = 0
+
+
+atexit.register(close_pool)
+
+
+def _search_worker(args):
+    """ Runs an independent search in a worker process and returns the statistics of the root's children. """
+    bot_name, state, iterations, deadline, seed, settings = args
+    bot = importlib.import_module(bot_name)
+    # Module globals set in the parent after the pool was started are not visible here, so they are sent along.
+    for name, value in settings.items():
+        setattr(bot, name, value)
+    # The random module is seeded as well, for the evaluators and priors drawing from it (e.g. evaluation's playouts)
+    seeds = random.Random(seed)
+    bot.rng.seed(seeds.getrandbits(32))
+    random.seed(seeds.getrandbits(32))
+
+    tree = bot.search(state, iterations, deadline=deadline)
+    children = tree.child_indices(0)
+    return tree.child_edges(0).tolist(), tree.wins[children].tolist(), tree.visits[children].tolist()
+
+
+def search_positions(bot_name, states, iterations, workers, settings=None, seed=None, deadline=None):
+    """ Searches a number of positions independently, spread over the shared process pool.
+
+    Args:
+        bot_name:   The module name of the bot whose search() is run, e.g. 'mcts_vanilla'.
+        states:     The states of the game to search.
+        iterations: The number of iterations of every search, or None to search until the deadline.
+        workers:    The number of worker processes.
+        settings:   Module globals of the bot (e.g. explore_faction) to set in the workers before searching.
+        seed:       The seed from which the seeds of the searches are drawn, for reproducible searches.
+        deadline:   The time.monotonic() time at which the searches stop, or None for no limit.
+
+    Returns:        For every state, in order, the lists of the edge indices tried at the root and of the wins and visits
+                    of each of them.
+
+    """
+    pool = get_pool(workers)
+    settings = settings or {}
+    seeds = random.Random(seed)
+    return pool.map(_search_worker, [(bot_name, state, iterations, deadline, seeds.getrandbits(32), settings)
+                                     for state in states])
+
+
+def root_parallel_search(bot_name, state, workers, iterations, settings=None, seed=None, deadline=None):
+    """ Searches a position with root parallelization: every worker process builds its own tree from the position with
+    a distinct random seed, and the statistics of the root's children are summed over all trees.
+
+    Args:
+        bot_name:   The module name of the bot whose search() is run, e.g. 'mcts_vanilla'.
+        state:      The state of the game.
+        workers:    The number of worker processes.
+        iterations: The total number of iterations, split as evenly as possible among the workers, or None to search
+                    until the deadline.
+        settings:   Module globals of the bot (e.g. explore_faction) to set in the workers before searching.
+        seed:       The seed from which the seeds of the workers are drawn, for reproducible searches.
+        deadline:   The time.monotonic() time at which the workers stop searching, or None for no limit.
+
+    Returns:        A dictionary mapping each edge index tried at the root to its summed (wins, visits).
+
+    """
+    pool = get_pool(workers)
+    settings = settings or {}
+    # Every worker gets its own random stream, seeded from a stream of seeds
+    seeds = random.Random(seed)
+    jobs = [(bot_name, state,
+             None if iterations is None else iterations // workers + (1 if i < iterations % workers else 0),
+             deadline, seeds.getrandbits(32), settings)
+            for i in range(workers)]
+
+    totals = {}
+    for actions, wins, visits in pool.map(_search_worker, jobs):
+        for action, w, v in zip(actions, wins, visits):
+            total_wins, total_visits = totals.get(action, (0, 0))
+            totals[action] = (total_wins + w, total_visits + v)
+    return totals
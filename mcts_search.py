@@ -0,0 +1,181 @@
+import numpy as np
+from time import monotonic
+
+
+class Searcher:
+    def __init__(self, search):
+        """ Wraps the search function of a bot so that the tree built for a move is kept and reused for the next one.
+
+        When asked to search a position reached from the previous root (by the bot's own move, the opponent's reply and
+        any extra turns after box captures), the searcher follows those moves down the previous tree and re-roots it at
+        the node reached, dropping everything else. Only the iterations that node is missing are then run.
+
+        Args:
+            search: The search function of a bot, called as search(state, iterations, tree, deadline) and returning
+                    the tree.
+
+        """
+        self._search = search
+        self.tree = None            # The tree of the last search
+        self.identity = None        # The player the last search was run for
+        self.root_history = None    # The history of the state at the root of the last search
+
+    def reset(self):
+        """ Forgets the last tree. """
+        self.tree = None
+        self.identity = None
+        self.root_history = None
+
+    def reuse(self, state):
+        """ Returns the part of the last tree rooted at the given state, or None if the state is of another game, was
+        not reached from the last root or is not in the tree.
+        """
+        if self.tree is None or state.game is not self.tree.game or state.player_turn != self.identity:
+            return None
+        played = len(self.root_history)
+        if state.history[:played] != self.root_history:
+            return None
+
+        node = 0
+        for edge, _, _, _ in state.history[played:]:
+            node = self.tree.find_child(node, edge)
+            if node < 0:
+                return None
+        return self.tree.subtree(node) if node else self.tree
+
+    def search(self, state, iterations, deadline=None):
+        """ Searches a state, reusing the last tree when possible.
+
+        Args:
+            state:      The state of the game.
+            iterations: The number of visits the root should have at the end of the search, or None for no limit.
+            deadline:   The time.monotonic() time at which the search stops, or None for no limit.
+
+        Returns:        The MCTSTree built.
+
+        """
+        tree = self.reuse(state)
+        if tree is None:
+            tree = self._search(state, iterations, deadline=deadline)
+        else:
+            if iterations is not None:
+                iterations = max(0, iterations - int(tree.visits[0]))
+            tree = self._search(state, iterations, tree, deadline)
+        self.tree = tree
+        self.identity = state.player_turn
+        self.root_history = state.history[:]
+        return tree
+
+
+class SearchBudget:
+    def __init__(self, iterations=None, deadline=None, check_every=16, monitor=None):
+        """ Decides when a search stops: after a number of iterations, at a deadline, as soon as the most visited
+        child of the root can no longer be overtaken by another child with the iterations left, or when a monitor asks
+        for it.
+
+        Args:
+            iterations:     The maximum number of iterations, or None for no limit.
+            deadline:       The time.monotonic() time at which the search stops, or None for no limit.
+            check_every:    The number of iterations between two checks of the clock and of the root statistics. A
+                            check is made whenever the iterations completed reach the next multiple of it, even if a
+                            batched search completes several iterations at once.
+            monitor:        If given, a function called at every check as monitor(tree, completed), e.g. to report
+                            progress; the search stops if it returns True.
+
+        """
+        if iterations is None and deadline is None:
+            raise ValueError("A search needs an iteration cap, a deadline or both.")
+        self.iterations = iterations
+        self.deadline = deadline
+        self.check_every = check_every
+        self.monitor = monitor
+        self.next_check = 0         # The number of completed iterations from which the next check is made
+        self.start = monotonic()
+
+    def exhausted(self, tree, completed):
+        """ Returns whether the search should stop.
+
+        Args:
+            tree:       The tree being searched.
+            completed:  The number of iterations completed so far by this search.
+
+        """
+        if self.iterations is not None and completed >= self.iterations:
+            return True
+        if completed < self.next_check or not tree.num_children[0]:
+            # The root needs at least one child for a move to be chosen
+            return False
+        self.next_check = (completed // self.check_every + 1) * self.check_every
+        if self.monitor is not None and self.monitor(tree, completed):
+            return True
+
+        left = float('inf') if self.iterations is None else self.iterations - completed
+        if self.deadline is not None:
+            now = monotonic()
+            if now >= self.deadline:
+                return True
+            if completed:
+                # Estimate the iterations left from the rate so far
+                left = min(left, completed * (self.deadline - now) / (now - self.start))
+
+        visits = tree.visits[tree.child_indices(0)]
+        if tree.untried[0]:
+            # Untried actions have no visits yet
+            visits = np.append(visits, 0)
+        if len(visits) == 1:
+            # Only one move is possible
+            return True
+        second, best = np.partition(visits, -2)[-2:]
+        return best - second > left
+
+
+class TimeManager:
+    def __init__(self, total_time, instability=0.5, extension=2.):
+        """ Splits a time budget for a whole game over the moves of a bot.
+
+        Every move is given an equal share of the time left, counting the bot to play about half of the remaining lines.
+        If, after that share, the most visited child of the root holds less than `instability` of the root's visits,
+        the search is extended up to `extension` times the share, as the choice is not settled yet.
+
+        Args:
+            total_time:     The number of seconds the bot may spend on the game.
+            instability:    The share of the root visits below which the best move is considered unsettled.
+            extension:      The factor of the move's share of time the search may be extended to.
+
+        """
+        self.total_time = total_time
+        self.remaining = total_time
+        self.instability = instability
+        self.extension = extension
+
+    def new_game(self):
+        """ Resets the budget for a new game. """
+        self.remaining = self.total_time
+
+    def think(self, bot, state):
+        """ Has a bot choose a move within its share of the time left.
+
+        Args:
+            bot:    A bot module (or bot_instance.BotInstance). MCTS bots are given deadlines, and the ones reusing
+                    their tree may extend their search; others are called as they are and timed.
+            state:  The state of the game.
+
+        Returns:    The action to be taken.
+
+        """
+        start = monotonic()
+        if not hasattr(bot, 'search'):
+            move = bot.think(state)
+        else:
+            moves_left = max(1, (len(state.legal_moves) + 1) // 2)
+            share = max(0., self.remaining) / moves_left
+            move = bot.think(state, deadline=start + share)
+
+            if getattr(bot, 'reuse_tree', False):
+                tree = bot.searcher.tree
+                visits = tree.visits[tree.child_indices(0)] if tree is not None else []
+                if len(visits) > 1 and visits.max() < self.instability * visits.sum():
+                    # Searching the same state again continues with the same tree
+                    move = bot.think(state, deadline=start + min(self.extension * share, self.remaining))
+        self.remaining -= monotonic() - start
+        return move
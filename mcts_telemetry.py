@@ -0,0 +1,152 @@
+
+from time import perf_counter
+
+import numpy as np
+
+PHASES = ('copy', 'make_room', 'traverse_nodes', 'expand_leaf', 'rollout', 'backpropagate', 'rewind')
+
+
+class Telemetry:
+    def __init__(self, bot_name=None):
+        """ Collects statistics about the searches of an MCTS bot, one record per search (i.e. per move).
+
+        A bot only collects them while its `telemetry` global is set to an instance of this class; otherwise its search
+        loop runs uninstrumented. Only the serial search loop of mcts_core.search is instrumented: root parallel and
+        batched searches are not recorded.
+
+        Args:
+            bot_name:   The module name of the bot, copied into every record.
+
+        """
+        self.bot_name = bot_name
+        self.records = []
+
+    def clear(self):
+        """ Drops the records collected so far. """
+        self.records = []
+
+    def start(self, tree, state):
+        """ Starts recording a search, whose record is appended once the search calls finish() on the returned
+        SearchRecorder.
+
+        Args:
+            tree:   The MCTSTree the search grows, rooted at the state.
+            state:  The state of the game.
+
+        """
+        return SearchRecorder(self, tree, state)
+
+
+class SearchRecorder:
+    def __init__(self, telemetry, tree, state):
+        """ Accumulates the statistics of one search of the serial search loop (see mcts_core.search), which reports
+        the times of every iteration to it.
+
+        Args:
+            telemetry:  The Telemetry the record goes to.
+            tree:       The MCTSTree the search grows, rooted at the state.
+            state:      The state of the game.
+
+        """
+        self.telemetry = telemetry
+        self.state = state
+        self.phases = dict.fromkeys(PHASES, 0.)
+        self.depths = []
+        self.rollout_lengths = []
+        self.start_visits = int(tree.visits[0])
+        self.start = perf_counter()
+
+    def add_iteration(self, times, depth, lines_left):
+        """ Records an iteration of the search.
+
+        Args:
+            times:      The perf_counter() times at the start of the iteration and at the end of each of its phases,
+                        from make_room to rewind (see PHASES).
+            depth:      The depth of the node the rollout started from.
+            lines_left: The bitmask of the lines left to draw when the rollout started.
+
+        """
+        phases = self.phases
+        for phase, begin, end in zip(PHASES[1:], times, times[1:]):
+            phases[phase] += end - begin
+        self.depths.append(depth)
+        self.rollout_lengths.append(bin(lines_left).count('1'))
+
+    def finish(self, tree, iterations):
+        """ Appends the record of the search to the telemetry.
+
+        Args:
+            tree:       The MCTSTree built.
+            iterations: The number of iterations the search ran.
+
+        """
+        seconds = perf_counter() - self.start
+        state = self.state
+        children = tree.child_indices(0)
+        num_children = tree.num_children[:tree.size]
+        self.telemetry.records.append({
+            'bot': self.telemetry.bot_name,
+            'player': state.player_turn,
+            'ply': len(state.history),
+            'legal_moves': bin(state.legal_edges).count('1'),
+            'iterations': iterations,
+            'reused_visits': self.start_visits,
+            'seconds': seconds,
+            'iterations_per_second': iterations / seconds if seconds else 0.,
+            'phases': self.phases,
+            'tree_nodes': tree.size,
+            'tree_bytes': tree.nbytes,
+            'depth_histogram': np.bincount(self.depths).tolist() if self.depths else [],
+            # Number of children of the expanded nodes (those with at least one child)
+            'branching_histogram': np.bincount(num_children[num_children > 0]).tolist(),
+            # Number of lines left to draw when each rollout started
+            'rollout_length_histogram': np.bincount(self.rollout_lengths).tolist() if self.rollout_lengths else [],
+            'root_edges': tree.child_edges(0).tolist(),
+            'root_visits': tree.visits[children].tolist()})
+
+
+def _add_histogram(total, histogram):
+    """ Adds a histogram (a list of counts per value) into another, in place. """
+    if len(total) < len(histogram):
+        total.extend([0] * (len(histogram) - len(total)))
+    for value, count in enumerate(histogram):
+        total[value] += count
+
+
+def aggregate(records):
+    """ Sums up the records of a number of searches, e.g. those of a bot over a tournament.
+
+    Args:
+        records:    A list of records made by SearchRecorder.finish.
+
+    Returns:        A dictionary with the number of searches, their total iterations and seconds, the overall iterations
+                    per second, the total and relative time of every phase, the mean and maximum tree size (in
+                    nodes and in estimated bytes), and the summed depth, branching and rollout length histograms.
+
+    """
+    if not records:
+        return {'searches': 0}
+    phases = dict.fromkeys(PHASES, 0.)
+    histograms = {'depth_histogram': [], 'branching_histogram': [], 'rollout_length_histogram': []}
+    for record in records:
+        for phase, seconds in record['phases'].items():
+            phases[phase] += seconds
+        for name, total in histograms.items():
+            _add_histogram(total, record[name])
+
+    iterations = sum(record['iterations'] for record in records)
+    seconds = sum(record['seconds'] for record in records)
+    phased = sum(phases.values())
+    tree_nodes = [record['tree_nodes'] for record in records]
+    tree_bytes = [record['tree_bytes'] for record in records]
+    return dict({'searches': len(records),
+                 'iterations': iterations,
+                 'seconds': seconds,
+                 'iterations_per_second': iterations / seconds if seconds else 0.,
+                 'phases': phases,
+                 'phase_shares': {phase: total / phased if phased else 0. for phase, total in phases.items()},
+                 'mean_tree_nodes': sum(tree_nodes) / len(tree_nodes),
+                 'max_tree_nodes': max(tree_nodes),
+                 'mean_tree_bytes': sum(tree_bytes) / len(tree_bytes),
+                 'max_tree_bytes': max(tree_bytes)},
+                **histograms)
@@ -2,137 +2,90 @@
 # Joseph Rossi
 # CMPM146 P2
 
-from mcts_node import MCTSNode
-from random import choice
-from math import sqrt, log
+import sys
+from random import Random
 
+import mcts_core
+from mcts_search import Searcher
+from p2_game import winner_of
+
+rng = Random()          # Random number generator of the search; seed it for reproducible searches
 num_nodes = 1000
 explore_faction = 2.
-
-
-def traverse_nodes(node, state, identity):
-    """ Traverses the tree until the end criterion are met.
-
-    Args:
-        node:       A tree node from which the search is traversing.
-        state:      The state of the game.
-        identity:   The bot's identity, either 'red' or 'blue'.
-
-    Returns:        A node from which the next stage of the search can proceed.
-
-    """
-
-    child_values = node.child_nodes.values()
-    # Checking to make sure there are no untried actions
-    # and there are still child nodes left
-    while node.untried_actions == [] and len(child_values) != 0:
-        if state.player_turn == identity:
-            # Maximize bot's chances of winning
-            node = max(child_values, key=lambda c: (c.wins / c.visits)
-                                                   + explore_faction * sqrt(2 * log(c.parent.visits) / c.visits))
-        else:
-            # Maximize bot's chance of losing
-            node = max(child_values, key=lambda c: (1 - (c.wins / c.visits)
-                                                    + explore_faction * sqrt(2 * log(c.parent.visits) / c.visits)))
-        state.apply_move(node.parent_action)
-        child_values = node.child_nodes.values()
-    return node
-
-    pass
-    # Hint: return leaf_node
-
-
-def expand_leaf(node, state):
-    """ Adds a new leaf to the tree by creating a new child node for the given node.
+num_workers = 1         # Number of processes searching in parallel from the root; 1 searches in this process
+split_nodes = True      # Whether num_nodes is split among the workers, or run by every one of them
+batch_size = 1          # Number of leaves selected (with virtual loss) and evaluated together per round
+evaluator = None        # Evaluator of the selected leaves; None plays them out one by one with rollout(),
+                        # rollout_engine.VectorizedEvaluator() plays them all out together with NumPy and
+                        # evaluation.LinearEvaluator() scores them with a static evaluation after a short playout
+table_size = 0          # Number of entries of the transposition table sharing nodes between move orders; 0 for none
+reuse_tree = True       # Whether the part of the last tree below the position reached is reused by the next search
+telemetry = None        # mcts_telemetry.Telemetry recording the phase times and tree statistics of every search; None
+                        # runs the search loop uninstrumented
+endgame_lines = 0       # Number of lines left at or below which think() solves the game exactly instead of searching;
+                        # 0 never solves
+prune_moves = False     # Whether nodes only try one move per class of equivalent moves (see move_reduction)
+use_tablebase = False   # Whether think() plays every move from the board's endgame table, if one was built (see
+                        # tablebase)
+use_book = False        # Whether think() plays from the board's opening book, if it was built (see opening_book)
+monitor = None          # Function called every few iterations of a search as monitor(tree, completed), e.g. to show
+                        # progress; returning True stops the search (see mcts_search.SearchBudget)
+rave_bias = None        # Bias b of the blending of the children's all-moves-as-first win rates into their own, with
+                        # weight ñ / (n + ñ + 4b²nñ) for n visits and ñ AMAF visits; None disables RAVE
+expansion_prior = None  # Function choosing the untried move to expand, as prior(state, untried, rng) (see priors); None
+                        # picks one at random
+max_nodes = 0           # Cap on the number of nodes of the tree; 0 for none
+evict_nodes = True      # Whether a search that fills the tree evicts its least visited nodes, down to half of max_nodes,
+                        # or stops expanding and only refines the nodes it has
+
+
+def rollout(state, moves=None):
+    """ Given the state of the game, the rollout plays out the remainder randomly.
 
     Args:
-        node:   The node for which a child will be added.
         state:  The state of the game.
+        moves:  If given, a list to which the (edge index, player index) of every move of the rollout is appended.
 
-    Returns:    The added child node.
+    Returns:    The winner of the game played out, or 'tie'.
 
     """
-    new_node = node
-    # Checking to make sure there are still untried actions
-    if node.untried_actions:
-        # Randomly choose untried action
-        move = choice(node.untried_actions)
-        # Apply the move to the game state
-        state.apply_move(move)
-        # Make a new node with the move and the game state
-        new_node = MCTSNode(node, move, state.legal_moves)
-        # Append the new node to the tree
-        node.child_nodes[move] = new_node
-        # Remove the action from the list of untried actions
-        node.untried_actions.remove(move)
-    return new_node
-    pass
-    # Hint: return new_node
-
-
-def rollout(state):
-    """ Given the state of the game, the rollout plays out the remainder randomly.
+    # Random moves never change which lines are left, only whose turn it is, so the remaining lines are drawn in a random
+    # order in one pass without touching the state
+    return winner_of(state.game, state.playout(rng, record=moves))
 
-    Args:
-        state:  The state of the game.
 
-    """
-    # Checking to make sure there are still moves left
-    while not state.is_terminal():
-        # Choose a random move
-        state.apply_move(choice(state.legal_moves))
-    pass
+# The search itself is shared by the MCTS bots (see mcts_core); it reads this bot's settings from the globals above
+_bot = sys.modules[__name__]
 
 
-def backpropagate(node, won):
-    """ Navigates the tree from a leaf node to the root, updating the win and visit count of each node along the path.
+def search(state, iterations, tree=None, deadline=None):
+    """ Builds a game tree for the state with this bot's settings (see mcts_core.search).
 
     Args:
-        node:   A leaf node.
-        won:    An indicator of whether the bot won or lost the game.
+        state:      The state of the game.
+        iterations: The maximum number of games to sample, or None to sample until the deadline.
+        tree:       A tree rooted at the state to keep growing, e.g. from a previous search; by default a new one.
+        deadline:   The time.monotonic() time at which to stop sampling, or None to sample `iterations` games.
+
+    Returns:        The MCTSTree built.
 
     """
+    return mcts_core.search(_bot, state, iterations, tree, deadline)
+
 
-    while node:
-        # Increment the number of wins if the bot won
-        node.wins += won
-        # Increment the number of visits
-        node.visits += 1
-        # Trace back on the tree
-        node = node.parent
-    pass
+# Keeps the last tree between calls to think()
+searcher = Searcher(search)
 
 
-def think(state):
-    """ Performs MCTS by sampling games and calling the appropriate functions to construct the game tree.
+def think(state, deadline=None, iterations=None):
+    """ Performs MCTS with this bot's settings (see mcts_core.think).
 
     Args:
-        state:  The state of the game.
+        state:      The state of the game.
+        deadline:   The time.monotonic() time by which to answer, or None to run a fixed number of iterations.
+        iterations: The maximum number of iterations; by default num_nodes, or unlimited if a deadline is given.
 
-    Returns:    The action to be taken.
+    Returns:        The action to be taken.
 
     """
-    identity_of_bot = state.player_turn
-    root_node = MCTSNode(parent=None, parent_action=None, action_list=state.legal_moves)
-
-    for step in range(num_nodes):
-        # Copy the game for sampling a playthrough
-        sampled_game = state.copy()
-        # Start at root
-        node = root_node
-        # Do MCTS - This is all you!
-        # Select
-        v1 = traverse_nodes(node, sampled_game, identity_of_bot)
-        # Expand
-        delta = expand_leaf(v1, sampled_game)
-        # Rollout
-        rollout(sampled_game)
-        # Iterator for backpropogate and win
-        result = 0
-        if identity_of_bot == sampled_game.winner:
-            result = 1
-        backpropagate(delta, result)
-
-    # Return an action, typically the most frequently used action (from the root) or the action with the best
-    # estimated win rate
-    return max(root_node.child_nodes.values(), key=lambda c: c.visits).parent_action
+    return mcts_core.think(_bot, state, deadline, iterations)
@@ -1,67 +1,53 @@
-from mcts_node import MCTSNode
+from mcts_node import MCTSTree
+from p2_game import edge_indices
 from random import choice
-from math import sqrt, log
 
 num_nodes = 1000
 explore_faction = 0.1
 
 
-def traverse_nodes(node, state, identity):
+def traverse_nodes(tree, node, state, identity):
     """ Traverses the tree until the end criterion are met.
 
     Args:
-        node:       A tree node from which the search is traversing.
+        tree:       The search tree.
+        node:       The index of a tree node from which the search is traversing.
         state:      The state of the game.
         identity:   The bot's identity, either 'red' or 'blue'.
 
-    Returns:        A node from which the next stage of the search can proceed.
+    Returns:        The index of a node from which the next stage of the search can proceed.
 
     """
-    # Return a leaf node
-
-    nn = node.child_nodes.values()
-
-    while node.untried_actions == [] and len(nn) != 0:
-        if state.player_turn == identity:
-            node = max(nn, key=lambda c: ((c.wins/c.visits) + explore_faction *
-                                          sqrt(2 * log(c.parent.visits) / c.visits)))
-        else:
-            node = max(nn, key=lambda c: ((1 - c.wins / c.visits) + explore_faction *
-                                          sqrt(2 * log(c.parent.visits) / c.visits)))
-        state.apply_move(node.parent_action)
-        nn = node.child_nodes.values()
+    # Checking to make sure there are no untried actions
+    # and there are still child nodes left
+    while not tree.untried[node] and tree.num_children[node]:
+        # Maximize bot's chances of winning, or the chance of losing on the opponent's turn
+        node, edge = tree.best_child(node, explore_faction, state.player_turn == identity)
+        state.apply_move(state.game.moves[edge])
     return node
-    pass
 
 
-def expand_leaf(node, state):
+def expand_leaf(tree, node, state):
     """ Adds a new leaf to the tree by creating a new child node for the given node.
 
     Args:
-        node:   The node for which a child will be added.
+        tree:   The search tree.
+        node:   The index of the node for which a child will be added.
         state:  The state of the game.
 
-    Returns:    The added child node.
+    Returns:    The index of the added child node.
 
     """
-
-    # Make sure there are still actions to be taken
-    # if node.untried_actions!=[]:
-    if node.untried_actions:
-
-        move = choice(node.untried_actions)
-
-        state.apply_move(move)
-
-        node.untried_actions.remove(move)
-        new_node = MCTSNode(node, move, node.untried_actions)
-
-        node.child_nodes[move] = new_node
-        return new_node
-    else:
-        return node
-    pass
-    # Hint: return new_node
+    new_node = node
+    # Checking to make sure there are still untried actions
+    if tree.untried[node]:
+        # Randomly choose untried action
+        edge = choice(edge_indices(tree.untried[node]))
+        # Apply the move to the game state
+        state.apply_move(state.game.moves[edge])
+        # Make a new node with the move and the game state, which also removes it from the untried actions
+        new_node = tree.add_child(node, edge, state.legal_edges)
+    return new_node
 
 
 def rollout(state):
@@ -71,25 +57,23 @@ def rollout(state):
         state:  The state of the game.
 
     """
+    # Checking to make sure there are still moves left
     while not state.is_terminal():
+        # Choose a random move
         state.apply_move(choice(state.legal_moves))
     pass
 
 
-def backpropagate(node, won):
+def backpropagate(tree, node, won):
     """ Navigates the tree from a leaf node to the root, updating the win and visit count of each node along the path.
 
     Args:
-        node:   A leaf node.
+        tree:   The search tree.
+        node:   The index of a leaf node.
         won:    An indicator of whether the bot won or lost the game.
 
     """
-
-    while node:
-        node.wins += won
-        node.visits += 1
-        node = node.parent
-    pass
+    tree.backpropagate(node, won)
 
 
 def think(state):
@@ -102,33 +86,33 @@ def think(state):
 
     """
     identity_of_bot = state.player_turn
-    root_node = MCTSNode(parent=None, parent_action=None, action_list=state.legal_moves)
+    tree = MCTSTree(state.game, state.legal_edges)
+
+    # A single copy of the game is used for sampling every playthrough; the moves of each playthrough are taken back
+    # once its result has been backpropagated.
+    sampled_game = state.copy()
+    start_ply = len(sampled_game.history)
 
     for step in range(num_nodes):
-        # Copy the game for sampling a playthrough
-        sampled_game = state.copy()
         # Start at root
-        node = root_node
+        node = 0
         # Do MCTS - This is all you!
-
-        # Selection
-        v1 = traverse_nodes(node, sampled_game, identity_of_bot)
-
-        # Expansion
-        delta = expand_leaf(v1, sampled_game)
-
-        # Simulation
+        # Select
+        v1 = traverse_nodes(tree, node, sampled_game, identity_of_bot)
+        # Expand
+        delta = expand_leaf(tree, v1, sampled_game)
+        # Rollout
         rollout(sampled_game)
-
-        # Incrementor for wins
+        # Iterator for backpropogate and win
         result = 0
         if identity_of_bot == sampled_game.winner:
             result = 1
+        backpropagate(tree, delta, result)
 
-        # Backpropogation
-        backpropagate(delta, result)
+        # Rewind the sampled game to the root position
+        sampled_game.rewind(start_ply)
 
     # Return an action, typically the most frequently used action (from the root) or the action with the best
     # estimated win rate.
-    # print(root_node.tree_to_string(horizon=3))
-    return max(root_node.child_nodes.values(), key=lambda c: c.wins/c.visits).parent_action
+    # print(tree.node().tree_to_string(horizon=3))
+    return state.game.moves[tree.best_rate_child(0)[1]]
@@ -0,0 +1,67 @@
+
+from p2_game import edge_indices, map_bits
+
+
+def forced_capture(state):
+    """ Finds a capture that is at least as good as any other move: one closing a box without drawing the third side
+    of a neighbouring box. Such a capture does not open anything to the opponent and keeps the turn, so there is no
+    reason to delay it. Captures that lead further along a chain are left alone, as declining the last boxes of a chain
+    (a double-dealing move) may be better.
+
+    Args:
+        state:  The state of the game.
+
+    Returns:    The edge index of the capture, or -1 if there is none.
+
+    """
+    game = state.game
+    two_sided = state.side_masks[2]
+    for box in edge_indices(state.capturable_boxes):
+        edge = (game.box_edges[box] & ~state.edges).bit_length() - 1
+        if not any(two_sided >> other & 1 for other in game.edge_boxes[edge] if other != box):
+            return edge
+    return -1
+
+
+def reduced_edges(state):
+    """ Groups the legal moves of a state into classes of equivalent moves and keeps one representative of each.
+
+    If there is a forced capture (see forced_capture), it is the only move kept. Otherwise, moves are equivalent when
+    they are mapped to one another by a symmetry of the board leaving the drawn lines unchanged (the margin of boxes
+    left to win only depends on the drawn lines), and all the lines inside a long chain (three boxes or more) or a loop
+    are equivalent, as drawing any of them hands over the whole group. The lines at the ends of a chain also change the
+    boxes beyond it and are kept apart.
+
+    Args:
+        state:  The state of the game.
+
+    Returns:    The bitmask of the edge indices of the representative moves, a subset of state.legal_edges.
+
+    """
+    forced = forced_capture(state)
+    if forced >= 0:
+        return 1 << forced
+
+    game = state.game
+    edges = state.edges
+    candidates = game.all_edges & ~edges
+
+    # Keep the smallest edge of every orbit under the symmetries that fix the drawn lines
+    stabilizer = [edge_map for edge_map, _, _ in game.symmetries[1:] if map_bits(edges, edge_map) == edges]
+    if stabilizer:
+        for edge in edge_indices(candidates):
+            if any(edge_map[edge] < edge for edge_map in stabilizer):
+                candidates &= ~(1 << edge)
+
+    # Keep one of the lines inside every long chain and loop
+    chains, loops = state.chains
+    for group in [chain for chain in chains if chain.bit_count() >= 3] + loops:
+        inside = 0
+        for box in edge_indices(group):
+            for edge in edge_indices(game.box_edges[box] & ~edges):
+                if all(group >> other & 1 for other in game.edge_boxes[edge]) and len(game.edge_boxes[edge]) == 2:
+                    inside |= 1 << edge
+        inside &= candidates
+        if inside:
+            candidates &= ~(inside & (inside - 1))
+    return candidates
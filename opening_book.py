@@ -0,0 +1,148 @@
+
+import argparse
+import hashlib
+import os
+import random
+
+import numpy as np
+
+from mcts_parallel import search_positions
+from p2_game import canonical_key, create_game, State, untransform_move
+
+# One record per position: the 64-bit digest of its canonical key, the best move (as an edge index of the canonical
+# position), the number of visits of that move and its win rate for the player to move.
+RECORD = np.dtype([('key', '<u8'), ('edge', '<i2'), ('visits', '<u4'), ('win_rate', '<f4')])
+
+# Books are loaded once per file, keyed by absolute path; None records that a file holds no book
+_books = {}
+
+
+def default_path(width):
+    """ Returns the default location of a board's book, next to this module. """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'opening_book_%d.bin' % width)
+
+
+def book_key(state):
+    """ Returns the book key of a state, shared by all the states equivalent to it under a symmetry of the board, and
+    the index of the symmetry mapping the state to its canonical form (see p2_game.canonical_key).
+    """
+    key, symmetry = canonical_key(state)
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little'), symmetry
+
+
+def build(width, plies, bot_name='mcts_modified', iterations=20000, branching=3, workers=1, path=None, seed=None,
+          verbose=True):
+    """ Builds the opening book of a board from deep searches of the positions of the first plies.
+
+    Starting from the empty board, every position is searched once (up to symmetry) and the `branching` most visited
+    moves of its search are followed to the positions of the next ply, so that the book covers the lines the bots are
+    likely to play. The searches of a ply run in parallel on the shared process pool (see
+    mcts_parallel.search_positions).
+
+    Args:
+        width:      The size of the grid in vertices.
+        plies:      The number of moves from the start covered by the book.
+        bot_name:   The module name of the bot whose search() is run, e.g. 'mcts_modified'.
+        iterations: The number of iterations of every search.
+        branching:  The number of moves followed from every position.
+        workers:    The number of worker processes.
+        path:       The file to write the book to; by default default_path(width).
+        seed:       The seed from which the seeds of the searches are drawn, for reproducible books.
+        verbose:    Whether to print the progress of the build.
+
+    Returns:        The path of the book.
+
+    """
+    path = path or default_path(width)
+    game = create_game(width)
+    seeds = random.Random(seed)
+
+    records = {}
+    level = [State(game)]
+    for ply in range(plies):
+        positions = {}
+        for state in level:
+            key, symmetry = book_key(state)
+            if key not in records and key not in positions:
+                positions[key] = (state, symmetry)
+        results = search_positions(bot_name, [state for state, _ in positions.values()], iterations, workers,
+                                   seed=seeds.getrandbits(32))
+
+        level = []
+        for (key, (state, symmetry)), (edges, wins, visits) in zip(positions.items(), results):
+            order = sorted(range(len(edges)), key=lambda child: visits[child], reverse=True)
+            best = order[0]
+            canonical_edge = game.symmetries[symmetry][0][edges[best]]
+            records[key] = (key, canonical_edge, visits[best], wins[best] / visits[best])
+            for child in order[:branching]:
+                next_state = state.copy()
+                next_state.apply_move(game.moves[edges[child]])
+                if not next_state.is_terminal():
+                    level.append(next_state)
+        if verbose:
+            print("Ply %d: %d positions searched" % (ply, len(positions)))
+
+    book = np.array(sorted(records.values()), dtype=RECORD)
+    book.tofile(path)
+    # A book loaded before from this file is out of date
+    _books.pop(os.path.abspath(path), None)
+    return path
+
+
+def load(game, path=None):
+    """ Returns the opening book of a game's board, memory-mapped read-only, or None if it has not been built. Only the
+    pages of the book touched by lookups are read from disk.
+
+    Args:
+        game:   The game (see p2_game.create_game).
+        path:   The file of the book; by default default_path(game.width).
+
+    """
+    path = os.path.abspath(path or default_path(game.width))
+    if path not in _books:
+        book = None
+        if os.path.exists(path) and os.path.getsize(path):
+            book = np.memmap(path, dtype=RECORD, mode='r')
+        _books[path] = book
+    return _books[path]
+
+
+def book_move(state):
+    """ Looks a state up in the opening book of its board.
+
+    Args:
+        state:  The state of the game.
+
+    Returns:    The move stored for the state, translated back from its canonical form, or None if the board has no
+                book or the state is not in it.
+
+    """
+    book = load(state.game)
+    if book is None:
+        return None
+    key, symmetry = book_key(state)
+    keys = book['key']
+    index = np.searchsorted(keys, np.uint64(key))
+    if index == len(book) or keys[index] != key:
+        return None
+    game = state.game
+    return untransform_move(game, game.moves[int(book['edge'][index])], symmetry)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds the opening book of a board by searching its first plies.")
+    parser.add_argument('--width', type=int, default=4, help="Size of the grid in vertices (default 4).")
+    parser.add_argument('--plies', type=int, default=4, help="Number of moves from the start covered (default 4).")
+    parser.add_argument('--bot', default='mcts_modified', help="Bot module whose search is run (default mcts_modified).")
+    parser.add_argument('--iterations', type=int, default=20000, help="Iterations of every search (default 20000).")
+    parser.add_argument('--branching', type=int, default=3, help="Moves followed from every position (default 3).")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of worker processes.")
+    parser.add_argument('--path', help="File to write the book to (default opening_book_<width>.bin here).")
+    parser.add_argument('--seed', type=int, help="Seed of the searches, for reproducible books.")
+    args = parser.parse_args()
+    print(build(args.width, args.plies, args.bot, args.iterations, args.branching, args.workers, args.path, args.seed))
+
+
+if __name__ == '__main__':
+    main()
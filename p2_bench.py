@@ -0,0 +1,203 @@
+import argparse
+import json
+import platform
+import random
+import sys
+from timeit import Timer, default_timer as time
+
+from bot_instance import BotInstance
+from p2_game import create_game, State
+import mcts_core
+import mcts_modified
+import mcts_vanilla
+import rollout_bot
+from mcts_node import MCTSTree
+from rollout_engine import play_out
+
+BOTS = {'mcts_vanilla': mcts_vanilla, 'mcts_modified': mcts_modified, 'rollout_bot': rollout_bot}
+
+# Settings of the MCTS bots in the think benchmarks, so that they time the search itself on every board, whatever
+# endgame tables or opening books happen to be on disk
+THINK_SETTINGS = {'endgame_lines': 0, 'use_tablebase': False, 'use_book': False}
+
+
+def measure(function, repeat=3):
+    """ Times a function, calling it enough times to take about 0.2 seconds per measurement.
+
+    Returns:    The best time of `repeat` measurements, in seconds per call.
+
+    """
+    timer = Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def random_state(game, moves, rng):
+    """ Returns a state of the game after a number of random moves. """
+    state = State(game)
+    for _ in range(moves):
+        if state.is_terminal():
+            break
+        state.apply_move(rng.choice(state.legal_moves))
+    return state
+
+
+def bench_engine(width, rng):
+    """ Benchmarks the State operations on a board. Returns a dictionary of seconds per call. """
+    game = create_game(width)
+    start = State(game)
+    middle = random_state(game, len(game.moves) // 2, rng)
+    order = list(game.moves)
+    rng.shuffle(order)
+
+    def apply_all():
+        # Plays a whole game, so that every kind of move (capturing or not) is counted
+        state = start.copy()
+        for move in order:
+            state.apply_move(move)
+
+    def apply_undo():
+        token = middle.apply_move(middle_move)
+        middle.undo_move(token)
+
+    def score_winner():
+        return middle.score, middle.winner
+
+    def random_rollout():
+        return mcts_vanilla.rollout(start)
+
+    middle_move = middle.legal_moves[0]
+    batch = [start] * 256
+    return {'apply_move': measure(apply_all) / len(order),
+            'apply_move+undo_move': measure(apply_undo),
+            'copy': measure(middle.copy),
+            'legal_moves': measure(lambda: middle.legal_moves),
+            'score+winner': measure(score_winner),
+            'rollout': measure(random_rollout),
+            'play_out_batch256': measure(lambda: play_out(batch))}
+
+
+def bench_tree(width, rng, iterations=1000):
+    """ Benchmarks the phases of mcts_vanilla's search loop on a board, over `iterations` iterations from the start
+    position. Returns a dictionary of seconds per call.
+    """
+    game = create_game(width)
+    state = State(game)
+    identity = state.player_turn
+    tree = MCTSTree(game, state.legal_edges)
+    mcts_vanilla.rng.seed(rng.getrandbits(32))
+
+    phases = {'traverse_nodes': 0., 'expand_leaf': 0., 'backpropagate': 0.}
+    start_ply = len(state.history)
+    for step in range(iterations):
+        path = [0]
+        before = time()
+        leaf = mcts_core.traverse_nodes(mcts_vanilla, tree, 0, state, identity, path)
+        traversed = time()
+        node = mcts_core.expand_leaf(mcts_vanilla, tree, leaf, state)
+        expanded = time()
+        if node != leaf:
+            path.append(node)
+        won = mcts_vanilla.rollout(state) == identity
+        rolled_out = time()
+        mcts_core.backpropagate(tree, node, won, path)
+        done = time()
+        state.rewind(start_ply)
+
+        phases['traverse_nodes'] += traversed - before
+        phases['expand_leaf'] += expanded - traversed
+        phases['backpropagate'] += done - rolled_out
+    return {name: total / iterations for name, total in phases.items()}
+
+
+def bench_think(width, rng, nodes):
+    """ Benchmarks a think() call of every bot from the start position of a board, with MCTS bots limited to `nodes`
+    iterations and set up with THINK_SETTINGS. Returns a dictionary of seconds per call.
+    """
+    state = State(create_game(width))
+    results = {}
+    for name, bot in BOTS.items():
+        if hasattr(bot, 'searcher'):
+            bot = BotInstance(name, THINK_SETTINGS, rng.getrandbits(32))
+
+            def think():
+                # Every call searches from scratch rather than reusing the last tree
+                bot.searcher.reset()
+                return bot.think(state, iterations=nodes)
+        else:
+            if hasattr(bot, 'rng'):
+                bot.rng.seed(rng.getrandbits(32))
+
+            def think():
+                return bot.think(state)
+        results['think/' + name] = measure(think, repeat=1)
+    return results
+
+
+def run(widths, nodes, seed):
+    """ Runs every benchmark on every board width.
+
+    Returns:    A dictionary mapping 'width=<width>/<benchmark>' to seconds per call.
+
+    """
+    rng = random.Random(seed)
+    results = {}
+    for width in widths:
+        for group in (bench_engine(width, rng), bench_tree(width, rng), bench_think(width, rng, nodes)):
+            for name, seconds in group.items():
+                results['width=%d/%s' % (width, name)] = seconds
+                print("%-40s %12.3f us" % ('width=%d/%s' % (width, name), seconds * 1e6))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Prints the change of every benchmark against a baseline and returns the names of those slower by more than
+    `threshold` (a fraction, e.g. 0.1 for 10%).
+    """
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        ratio = seconds / baseline[name]
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = 'improvement'
+        print("%-40s %12.3f us -> %12.3f us  %+7.1f%%  %s"
+              % (name, baseline[name] * 1e6, seconds * 1e6, (ratio - 1) * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the game engine and the search hot paths.")
+    parser.add_argument('--widths', type=int, nargs='+', default=list(range(3, 11)),
+                        help="Board widths in vertices (default 3 to 10).")
+    parser.add_argument('--nodes', type=int, default=200, help="Iterations of the MCTS think() benchmarks.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the random positions and searches.")
+    parser.add_argument('--save', metavar='PATH', help="Saves the results as a JSON baseline.")
+    parser.add_argument('--compare', metavar='PATH', help="Compares the results against a saved baseline.")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Slowdown flagged as a regression in compare mode (default 0.1, i.e. 10%%).")
+    args = parser.parse_args()
+
+    results = run(args.widths, args.nodes, args.seed)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'python': sys.version, 'platform': platform.platform(), 'nodes': args.nodes,
+                       'seed': args.seed, 'results': results}, file, indent=1)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+        print("")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\n%d regression(s) above %.0f%%" % (len(regressions), args.threshold * 100))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
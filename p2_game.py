@@ -1,9 +1,29 @@
 
-from collections import namedtuple, Counter
+import random
+from collections import namedtuple
+from collections.abc import Mapping
 
 # As Game does not require any inner manipulation of variables, we can use a namedtuple
 # rather than defining a full class.
-Game = namedtuple('Game', ['width', 'players', 'dots', 'boxes', 'h_lines', 'v_lines'])
+#
+# Besides the geometric description of the board, a Game carries the lookup tables used by the bitboard State:
+# every line is given an edge index (horizontal lines first, then vertical lines) and every box a box index, so
+# that a State can record drawn lines and owned boxes as bits of plain integers.
+Game = namedtuple('Game', ['width', 'players', 'dots', 'boxes', 'h_lines', 'v_lines',
+                           'moves',         # Edge index -> move, e.g. ('h', (i, j))
+                           'edge_ids',      # Move -> edge index
+                           'edge_cells',    # Edge index -> line cell
+                           'h_index',       # Horizontal line cell -> edge index
+                           'v_index',       # Vertical line cell -> edge index
+                           'box_cells',     # Box index -> box cell
+                           'box_index',     # Box cell -> box index
+                           'edge_boxes',    # Edge index -> indices of the (one or two) boxes the edge borders
+                           'box_edges',     # Box index -> mask of the box's four edges
+                           'box_edge_indices',  # Box index -> indices of the box's four edges
+                           'all_edges',     # Mask with one bit set per edge
+                           'all_boxes',     # Mask with one bit set per box
+                           'zobrist',       # Hashing keys: (key per edge, key per box per player, key of the turn)
+                           'symmetries'])   # Per symmetry of the board: (edge index map, box index map, inverse)
 
 
 def create_game(width):
@@ -13,73 +33,471 @@ def create_game(width):
     h_lines = frozenset((i, j) for i in range(width - 1) for j in range(width))
     v_lines = frozenset((i, j) for i in range(width) for j in range(width - 1))
 
-    return Game(width, players, dots, boxes, h_lines, v_lines)
+    # Number the edges and boxes once, so that the per-move work in State is reduced to bit operations.
+    moves = tuple([('h', (i, j)) for i in range(width - 1) for j in range(width)] +
+                  [('v', (i, j)) for i in range(width) for j in range(width - 1)])
+    edge_ids = {move: edge for edge, move in enumerate(moves)}
+    edge_cells = tuple(cell for _, cell in moves)
+    h_index = {cell: edge for (orientation, cell), edge in edge_ids.items() if orientation == 'h'}
+    v_index = {cell: edge for (orientation, cell), edge in edge_ids.items() if orientation == 'v'}
+    box_cells = tuple((i, j) for i in range(width - 1) for j in range(width - 1))
+    box_index = {cell: box for box, cell in enumerate(box_cells)}
+
+    # A box (i, j) is closed by the horizontal lines (i, j) and (i, j + 1) and the vertical lines (i, j) and (i + 1, j).
+    box_edges = tuple((1 << h_index[(i, j)]) | (1 << h_index[(i, j + 1)]) | (1 << v_index[(i, j)]) | (1 << v_index[(i + 1, j)])
+                      for (i, j) in box_cells)
+    edge_boxes = tuple(tuple(box for box in range(len(box_cells)) if box_edges[box] >> edge & 1)
+                       for edge in range(len(moves)))
+    box_edge_indices = tuple(tuple(edge for edge in range(len(moves)) if mask >> edge & 1) for mask in box_edges)
+
+    # Random 64-bit keys for Zobrist hashing. They are drawn from a generator seeded with the width, so that the hash of
+    # a position is the same in every process.
+    keys = random.Random(width)
+    zobrist = (tuple(keys.getrandbits(64) for _ in moves),
+               tuple(tuple(keys.getrandbits(64) for _ in box_cells) for _ in players),
+               keys.getrandbits(64))
+
+    # The 8 symmetries of the square board, as maps of the edge and box indices.
+    symmetries = []
+    for transform in _DOT_TRANSFORMS:
+        def dot(x, y):
+            return transform(x, y, width - 1)
+
+        def line(a, b):
+            (ax, ay), (bx, by) = a, b
+            return ('h', (min(ax, bx), ay)) if ay == by else ('v', (ax, min(ay, by)))
+
+        edge_map = tuple(edge_ids[line(dot(i, j), dot(i + 1, j) if orientation == 'h' else dot(i, j + 1))]
+                         for orientation, (i, j) in moves)
+        box_map = tuple(box_index[tuple(map(min, zip(dot(i, j), dot(i + 1, j + 1))))] for (i, j) in box_cells)
+        symmetries.append((edge_map, box_map))
+    identity = tuple(range(len(moves)))
+    symmetries = tuple((edge_map, box_map, next(inverse for inverse, (other_map, _) in enumerate(symmetries)
+                                                 if tuple(other_map[edge] for edge in edge_map) == identity))
+                       for edge_map, box_map in symmetries)
+
+    return Game(width, players, dots, boxes, h_lines, v_lines,
+                moves, edge_ids, edge_cells, h_index, v_index, box_cells, box_index, edge_boxes, box_edges,
+                box_edge_indices, (1 << len(moves)) - 1, (1 << len(box_cells)) - 1, zobrist, symmetries)
+
+
+# The symmetries of a square board with dots 0..n on each side, as maps of the dot (x, y). The identity comes first.
+_DOT_TRANSFORMS = (
+    lambda x, y, n: (x, y),             # Identity
+    lambda x, y, n: (n - y, x),         # Rotation by 90 degrees
+    lambda x, y, n: (n - x, n - y),     # Rotation by 180 degrees
+    lambda x, y, n: (y, n - x),         # Rotation by 270 degrees
+    lambda x, y, n: (n - x, y),         # Mirror left to right
+    lambda x, y, n: (x, n - y),         # Mirror top to bottom
+    lambda x, y, n: (y, x),             # Mirror along the main diagonal
+    lambda x, y, n: (n - y, n - x),     # Mirror along the anti-diagonal
+)
+
+
+def map_bits(mask, index_map):
+    """ Returns the bitmask with bit index_map[i] set for every bit i set in mask. """
+    mapped = 0
+    while mask:
+        low = mask & -mask
+        mapped |= 1 << index_map[low.bit_length() - 1]
+        mask ^= low
+    return mapped
+
+
+def canonical_key(state):
+    """ Maps a state to a key shared by all the states equivalent to it under a symmetry of the board.
+
+    The key is the smallest, over the 8 symmetries, of the transformed (player to move, drawn lines, owned boxes, boxes
+    owned by the first player). Caches can store one entry per key, translating moves with transform_move.
+
+    Args:
+        state:  The state of the game.
+
+    Returns:    The key and the index of the symmetry mapping the state to it.
+
+    """
+    best_key, best_symmetry = None, 0
+    for symmetry, (edge_map, box_map, _) in enumerate(state.game.symmetries):
+        key = (state.turn, map_bits(state.edges, edge_map), map_bits(state.boxes, box_map),
+               map_bits(state.first_boxes, box_map))
+        if best_key is None or key < best_key:
+            best_key, best_symmetry = key, symmetry
+    return best_key, best_symmetry
+
+
+def transform_move(game, move, symmetry):
+    """ Maps a move of a state to the corresponding move of its image under a symmetry (e.g. from a state to its
+    canonical form, given the symmetry returned by canonical_key).
+    """
+    return game.moves[game.symmetries[symmetry][0][game.edge_ids[move]]]
+
+
+def untransform_move(game, move, symmetry):
+    """ Maps a move of the image of a state under a symmetry back to the corresponding move of the state (e.g. a move
+    stored for a canonical key back to the state it was looked up for).
+    """
+    return transform_move(game, move, game.symmetries[symmetry][2])
+
+
+def edge_indices(mask):
+    """ Returns the indices of the set bits of an edge (or box) bitmask, in increasing order. """
+    indices = []
+    while mask:
+        low = mask & -mask
+        indices.append(low.bit_length() - 1)
+        mask ^= low
+    return indices
+
+
+class _OwnerView(Mapping):
+    """ A read-only cell -> owner mapping over one of the bitmasks of a State. It stands in for the owner dicts the
+    State used to keep, so that code such as `(i, j) in state.h_line_owners` keeps working.
+    """
+    __slots__ = ('_index', '_cells', '_mask', '_first_mask', '_players')
+
+    def __init__(self, index, cells, mask, first_mask, players):
+        self._index = index             # Cell -> bit index
+        self._cells = cells             # Bit index -> cell
+        self._mask = mask               # Bits of the cells that are owned
+        self._first_mask = first_mask   # Bits of the cells that are owned by the first player
+        self._players = players
+
+    def __contains__(self, cell):
+        bit = self._index.get(cell)
+        return bit is not None and (self._mask >> bit) & 1 == 1
+
+    def __getitem__(self, cell):
+        if cell not in self:
+            raise KeyError(cell)
+        return self._players[0] if (self._first_mask >> self._index[cell]) & 1 else self._players[1]
+
+    def __iter__(self):
+        mask = self._mask
+        while mask:
+            low = mask & -mask
+            yield self._cells[low.bit_length() - 1]
+            mask ^= low
+
+    def __len__(self):
+        return self._mask.bit_count()
 
 
 class State:
+    """ The state of a game, stored as bitboards.
+
+    Drawn lines are the set bits of `edges` and owned boxes the set bits of `boxes`, both indexed as laid out by
+    create_game. Ownership is recorded by the extra masks `first_edges` and `first_boxes`, which hold the lines drawn
+    and boxes taken by the first player; everything else in `edges`/`boxes` belongs to the second player.
+
+    The State also keeps a few counters up to date as moves are made and undone: the number of boxes each player owns
+    (`box_counts`), the number of drawn sides of every box (`box_sides`) and the undo tokens of the moves played so far
+    (`history`). This lets a search play moves forward and take them back on a single State instead of copying it.
+    Finally, `hash` is the Zobrist hash of the position (drawn lines, box owners and player to move), which identifies
+    positions reached by different move orders.
+
+    For strategy, the State also tracks the boxes by number of drawn sides (`side_masks`) and the lines bordering a box
+    with two sides (`unsafe_edges`, with the number of such boxes per line in `unsafe_counts`), since drawing one of
+    them gives the opponent a box. The decomposition of the board into chains and loops is not tracked: `chains` rescans
+    the two-sided boxes when asked for and caches the result only until the lines change.
+    """
+    __slots__ = ('game', 'turn', 'edges', 'boxes', 'first_edges', 'first_boxes', 'box_counts', 'box_sides', 'history',
+                 'hash', 'side_masks', 'unsafe_counts', 'unsafe_edges', 'chain_cache')
+
     def __init__(self, game):
         self.game = game
-        self.player_turn = game.players[0]
-        self.box_owners = {}
-        self.h_line_owners = {}
-        self.v_line_owners = {}
+        self.turn = 0                                   # Index into game.players of the player to move
+        self.edges = 0
+        self.boxes = 0
+        self.first_edges = 0
+        self.first_boxes = 0
+        self.box_counts = [0] * len(game.players)       # Player index -> number of boxes owned
+        self.box_sides = bytearray(len(game.box_cells))  # Box index -> number of drawn sides
+        self.history = []                               # Undo tokens of the moves applied so far
+        self.hash = 0                                   # Zobrist hash of the position
+        self.side_masks = [game.all_boxes, 0, 0, 0, 0]  # Number of drawn sides -> mask of the boxes with that many
+        self.unsafe_counts = bytearray(len(game.moves))  # Edge index -> number of bordered boxes with two sides
+        self.unsafe_edges = 0                           # Mask of the edges bordering a box with two sides
+        self.chain_cache = None                         # (edges, chains and loops) of the last call to `chains`
 
     def copy(self):
-        res = State(self.game)
-        res.player_turn = self.player_turn
-        res.box_owners = self.box_owners.copy()
-        res.h_line_owners = self.h_line_owners.copy()
-        res.v_line_owners = self.v_line_owners.copy()
+        res = State.__new__(State)
+        res.game = self.game
+        res.turn = self.turn
+        res.edges = self.edges
+        res.boxes = self.boxes
+        res.first_edges = self.first_edges
+        res.first_boxes = self.first_boxes
+        res.box_counts = self.box_counts[:]
+        res.box_sides = self.box_sides[:]
+        res.history = self.history[:]
+        res.hash = self.hash
+        res.side_masks = self.side_masks[:]
+        res.unsafe_counts = self.unsafe_counts[:]
+        res.unsafe_edges = self.unsafe_edges
+        res.chain_cache = self.chain_cache
         return res
 
+    @property
+    def player_turn(self):
+        return self.game.players[self.turn]
+
     def apply_move(self, move):
+        """ Draws a line for the player to move, awarding any box it closes.
+
+        Args:
+            move:   The move to make, e.g. ('h', (0, 1)).
+
+        Returns:    An undo token, which undo_move accepts to take the move back.
 
-        orientation, cell = move
-        x,y = cell
-
-        if orientation == 'h':
-            self.h_line_owners[cell] = self.player_turn
-            box_checks = [(x, y-1), (x,y)]
-        elif orientation == 'v':
-            self.v_line_owners[cell] = self.player_turn
-            box_checks = [(x-1, y), (x,y)]
-
-        new_boxes = False
-        for box in box_checks:
-            (i,j) = box
-            if (i, j) not in self.box_owners \
-                    and (i, j) in self.h_line_owners \
-                    and (i, j) in self.v_line_owners \
-                    and (i, j + 1) in self.h_line_owners \
-                    and (i + 1, j) in self.v_line_owners:
-                new_boxes = True
-                self.box_owners[box] = self.player_turn
-
-        if not new_boxes:
-            self.player_turn = self.game.players[(self.game.players.index(self.player_turn) + 1) % len(self.game.players)]
+        Raises:
+            ValueError: If the line is already drawn.
+
+        """
+        edge = self.game.edge_ids[move]
+        if self.edges >> edge & 1:
+            raise ValueError("%s is already drawn." % (move,))
+        turn = self.turn
+        box_sides = self.box_sides
+        edge_keys, box_keys, turn_key = self.game.zobrist
+        previous_hash = self.hash
+
+        self.edges |= 1 << edge
+        if turn == 0:
+            self.first_edges |= 1 << edge
+        self.hash ^= edge_keys[edge]
+
+        closed = 0
+        side_masks = self.side_masks
+        for box in self.game.edge_boxes[edge]:
+            box_sides[box] += 1
+            sides = box_sides[box]
+            side_masks[sides - 1] ^= 1 << box
+            side_masks[sides] |= 1 << box
+            if sides == 2 or sides == 3:
+                self._update_unsafe(box, 1 if sides == 2 else -1)
+            elif sides == 4:
+                closed |= 1 << box
+                self.box_counts[turn] += 1
+                self.hash ^= box_keys[turn][box]
+
+        if closed:
+            self.boxes |= closed
+            if turn == 0:
+                self.first_boxes |= closed
+        else:
+            self.turn = 1 - turn
+            self.hash ^= turn_key
+
+        token = (edge, turn, closed, previous_hash)
+        self.history.append(token)
+        return token
+
+    def undo_move(self, token=None):
+        """ Takes back the most recent move.
+
+        Args:
+            token:  The undo token returned by apply_move for that move. Moves must be undone in the reverse order of
+                    their application; if a token is given, it must be the one of the latest move.
+
+        Returns:    The move that was taken back.
+
+        """
+        last = self.history.pop()
+        if token is not None and token is not last:
+            self.history.append(last)
+            raise ValueError("Moves must be undone in the reverse order they were applied.")
+        edge, turn, closed, previous_hash = last
+        box_sides = self.box_sides
+
+        self.edges &= ~(1 << edge)
+        self.first_edges &= ~(1 << edge)
+        side_masks = self.side_masks
+        for box in self.game.edge_boxes[edge]:
+            sides = box_sides[box]
+            side_masks[sides] ^= 1 << box
+            side_masks[sides - 1] |= 1 << box
+            if sides == 2 or sides == 3:
+                self._update_unsafe(box, -1 if sides == 2 else 1)
+            box_sides[box] = sides - 1
+        if closed:
+            self.boxes &= ~closed
+            self.first_boxes &= ~closed
+            self.box_counts[turn] -= closed.bit_count()
+        self.turn = turn
+        self.hash = previous_hash
+        return self.game.moves[edge]
+
+    def _update_unsafe(self, box, change):
+        """ Adds `change` to the count of boxes with two sides bordered by every edge of a box. """
+        unsafe_counts = self.unsafe_counts
+        for edge in self.game.box_edge_indices[box]:
+            unsafe_counts[edge] += change
+            if unsafe_counts[edge]:
+                self.unsafe_edges |= 1 << edge
+            else:
+                self.unsafe_edges &= ~(1 << edge)
+
+    def rewind(self, ply):
+        """ Undoes moves until only the first `ply` entries of the history remain.
+
+        Args:
+            ply:    The history length to return to, typically len(state.history) saved before a playout.
+
+        """
+        while len(self.history) > ply:
+            self.undo_move()
 
     def is_terminal(self):
-        return len(self.box_owners) == len(self.game.boxes)
-        #return any(score > len(self.game.boxes)/2 for score in self.score.values())
+        return self.boxes == self.game.all_boxes
+
+    @property
+    def legal_edges(self):
+        """ The bitmask of the edge indices of the legal moves. """
+        return self.game.all_edges & ~self.edges
 
     @property
     def legal_moves(self):
-        h_moves = [('h', h) for h in self.game.h_lines if h not in self.h_line_owners]
-        v_moves = [('v', v) for v in self.game.v_lines if v not in self.v_line_owners]
-        return h_moves + v_moves
+        moves = self.game.moves
+        return [moves[edge] for edge in edge_indices(self.game.all_edges & ~self.edges)]
+
+    @property
+    def capturable_boxes(self):
+        """ The bitmask of the boxes with three sides drawn, which the player to move can close. """
+        return self.side_masks[3]
+
+    @property
+    def capture_edges(self):
+        """ The bitmask of the edges closing a box. """
+        box_edges = self.game.box_edges
+        mask = 0
+        for box in edge_indices(self.side_masks[3]):
+            mask |= box_edges[box]
+        return mask & ~self.edges
 
+    @property
+    def safe_edges(self):
+        """ The bitmask of the edges that do not draw the third side of a box, i.e. do not give a box away. """
+        return self.game.all_edges & ~self.edges & ~self.unsafe_edges
+
+    @property
+    def safe_moves(self):
+        moves = self.game.moves
+        return [moves[edge] for edge in edge_indices(self.safe_edges)]
+
+    @property
+    def chains(self):
+        """ The decomposition into chains and loops of the boxes with two sides drawn: groups of such boxes joined by
+        undrawn lines, which fall to whoever draws the first of their lines. A loop is a group whose boxes are joined in
+        a cycle; every other group is a chain.
+
+        This is a lazy cache rather than incremental bookkeeping: the first call after any move or undo rescans the
+        two-sided boxes and their undrawn lines, in time linear in the number of such boxes, and only repeated calls on
+        the same lines are free.
+
+        Returns:    A pair of lists of box bitmasks, the chains and the loops.
+
+        """
+        if self.chain_cache is not None and self.chain_cache[0] == self.edges:
+            return self.chain_cache[1]
+
+        game = self.game
+        two_sided = self.side_masks[2]
+        chains, loops = [], []
+        left = two_sided
+        while left:
+            start = left & -left
+            group = start
+            links = 0
+            frontier = [start.bit_length() - 1]
+            while frontier:
+                box = frontier.pop()
+                for edge in edge_indices(game.box_edges[box] & ~self.edges):
+                    for other in game.edge_boxes[edge]:
+                        if other != box and two_sided >> other & 1:
+                            links += 1
+                            if not group >> other & 1:
+                                group |= 1 << other
+                                frontier.append(other)
+            left &= ~group
+            # Every link between two boxes of the group was counted from both ends
+            (loops if links // 2 == group.bit_count() else chains).append(group)
+
+        self.chain_cache = (self.edges, (chains, loops))
+        return chains, loops
+
+    @property
+    def long_chain_count(self):
+        """ The number of chains of three boxes or more. """
+        return sum(1 for chain in self.chains[0] if chain.bit_count() >= 3)
+
+    @property
+    def h_line_owners(self):
+        game = self.game
+        h_edges = (1 << len(game.h_lines)) - 1
+        return _OwnerView(game.h_index, game.edge_cells, self.edges & h_edges, self.first_edges, game.players)
+
+    @property
+    def v_line_owners(self):
+        game = self.game
+        h_edges = (1 << len(game.h_lines)) - 1
+        return _OwnerView(game.v_index, game.edge_cells, self.edges & ~h_edges, self.first_edges, game.players)
+
+    @property
+    def box_owners(self):
+        game = self.game
+        return _OwnerView(game.box_index, game.box_cells, self.boxes, self.first_boxes, game.players)
 
     @property
     def score(self):
-        return dict(Counter(self.box_owners.values()))
+        players = self.game.players
+        return {players[i]: count for i, count in enumerate(self.box_counts) if count}
 
     @property
     def winner(self):
-        if len(self.score) == 0:
-            return 'tie'
-        player, winning_score = max(self.score.items(), key=lambda pair: pair[1])
-        if winning_score == len(self.game.boxes)/2:
-            return 'tie'
+        return winner_of(self.game, self.box_counts)
+
+    def playout(self, rng=random, max_moves=None, record=None):
+        """ Plays the game on from this state with uniformly random moves, without modifying the state.
+
+        As completing a box only changes whose turn it is and never which lines may be drawn, a random playout is the
+        same as drawing the remaining lines in a random order. They are shuffled once and drawn in sequence, updating
+        only the box side counts, the box counts and the turn.
+
+        Args:
+            rng:        The random number generator (random.Random or the random module) to shuffle with.
+            max_moves:  If given, the number of moves after which the playout stops.
+            record:     If given, a list to which the (edge index, player index) of every move played is appended.
+
+        Returns:        The number of boxes of each player at the end of the playout, indexed like game.players.
+
+        """
+        remaining = edge_indices(self.game.all_edges & ~self.edges)
+        if max_moves is not None and max_moves < len(remaining):
+            remaining = rng.sample(remaining, max_moves)
         else:
-            return player
+            rng.shuffle(remaining)
+
+        edge_boxes = self.game.edge_boxes
+        box_sides = self.box_sides[:]
+        box_counts = self.box_counts[:]
+        turn = self.turn
+        for edge in remaining:
+            if record is not None:
+                record.append((edge, turn))
+            closed = False
+            for box in edge_boxes[edge]:
+                box_sides[box] += 1
+                if box_sides[box] == 4:
+                    box_counts[turn] += 1
+                    closed = True
+            if not closed:
+                turn = 1 - turn
+        return box_counts
+
 
+def winner_of(game, box_counts):
+    """ Returns the player with the most boxes given the box counts of a game, or 'tie'. """
+    first, second = box_counts
+    if first == second:
+        return 'tie'
+    return game.players[0] if first > second else game.players[1]
@@ -1,3 +1,7 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+from time import monotonic
 from tkinter import *
 from p2_game import create_game, State
 
@@ -6,6 +10,15 @@ import rollout_bot as blue_bot
 
 BOTS = {'red': red_bot, 'blue': blue_bot}
 
+# Tk may only be used from the thread running mainloop. Searches run on a background thread and post their progress
+# and results to EVENTS as (search id, kind, payload) tuples, which poll_events handles on the Tk thread. Events of a
+# search that is no longer the current one (after an undo or a restart) are dropped.
+EXECUTOR = ThreadPoolExecutor(max_workers=1)
+EVENTS = Queue()
+SEARCH = {'id': 0, 'cancel': None}
+POLL_MS = 50            # Milliseconds between two checks for events
+PROGRESS_INTERVAL = 0.1  # Seconds between two progress reports of a search
+
 
 def display(state):
     canvas.delete(ALL)
@@ -79,20 +92,67 @@ def make_move(state, move):
 
 
 def think(state):
-    import threading
-    class ThinkingThread(threading.Thread):
-        def run(self):
-            def quip(line):
-                AI_THOUGHTS.set(line)
-
-            move = BOTS[state.player_turn].think(state.copy())
-            make_move(state, move)
+    SEARCH['id'] += 1
+    search_id = SEARCH['id']
+    cancel = threading.Event()
+    SEARCH['cancel'] = cancel
+    bot = BOTS[state.player_turn]
+    last_report = [0.]
+
+    # Called by the MCTS bots every few iterations, on the search thread
+    def monitor(tree, completed):
+        now = monotonic()
+        if now - last_report[0] >= PROGRESS_INTERVAL and tree.num_children[0]:
+            last_report[0] = now
+            child, edge = tree.most_visited_child(0)
+            EVENTS.put((search_id, 'progress', "%d iterations, best so far: %s (%.0f%% wins)"
+                        % (completed, state.game.moves[edge], 100 * tree.wins[child] / max(1, tree.visits[child]))))
+        return cancel.is_set()
+
+    def run():
+        if hasattr(bot, 'monitor'):
+            bot.monitor = monitor
+        try:
+            return bot.think(state.copy())
+        finally:
+            if hasattr(bot, 'monitor'):
+                bot.monitor = None
+
+    AI_THOUGHTS.set("Thinking...")
+    future = EXECUTOR.submit(run)
+    future.add_done_callback(lambda future: EVENTS.put((search_id, 'done', (state, future))))
+
+
+def cancel_search():
+    SEARCH['id'] += 1
+    if SEARCH['cancel'] is not None:
+        # MCTS bots stop at their next check; the results of other bots are dropped
+        SEARCH['cancel'].set()
+    AI_THOUGHTS.set("")
+
+
+def poll_events():
+    while True:
+        try:
+            search_id, kind, payload = EVENTS.get_nowait()
+        except Empty:
+            break
+        if search_id != SEARCH['id']:
+            continue
+        if kind == 'progress':
+            AI_THOUGHTS.set(payload)
+        else:
+            state, future = payload
             AI_THOUGHTS.set("")
-
-    ThinkingThread().start()
+            if future.exception() is not None:
+                print("The bot failed to think:", repr(future.exception()))
+            else:
+                make_move(state, future.result())
+    master.after(POLL_MS, poll_events)
 
 
 def restart():
+    cancel_search()
     game = create_game(4)
     initial_state = State(game)
     UNDO_STACK[:] = [initial_state]
@@ -101,6 +161,7 @@ def restart():
 
 def undo():
     if len(UNDO_STACK) > 1:
+        cancel_search()
         UNDO_STACK.pop()
         display(UNDO_STACK[-1])
 
@@ -138,5 +199,9 @@ canvas = Canvas(master, width=w, height=h)
 canvas.pack(side=RIGHT)
 
 restart()
+poll_events()
 
 mainloop()
+
+cancel_search()
+EXECUTOR.shutdown(wait=False, cancel_futures=True)
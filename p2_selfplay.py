@@ -0,0 +1,346 @@
+import argparse
+import glob
+import mmap
+import os
+import random
+import struct
+import zlib
+
+import numpy as np
+
+from p2_game import create_game, edge_indices, State
+from p2_sim import check_pool_bots, DEFAULT_PAIRING, DEFAULT_SETTINGS, make_jobs, parse_setting, play_games, start_game
+
+# A shard starts with a header (magic, format version, board width) followed by chunks. Every chunk is a header (number
+# of records, size of the compressed data) followed by the zlib-compressed records. Shards are only ever appended to.
+MAGIC = b'DBSELFPL'
+VERSION = 1
+FILE_HEADER = struct.Struct('<8sHH')
+CHUNK_HEADER = struct.Struct('<II')
+
+
+def record_dtype(width):
+    """ Returns the NumPy dtype of the position records of a board.
+
+    Every record holds the game (its number in the run and its seed, which tells apart the games of runs appended to
+    the same shards) and ply of the position, the player to move (0 for the first player), the bitmasks of the drawn
+    lines and of the boxes of each player (packed little-endian: bit i of a mask is bit i % 8 of byte i // 8), the
+    visits of every edge at the root of the search that chose the move (one visit on the move played for bots that do
+    not search), and the outcome of the game for the player to move: 1 for a win, 0 for a tie and -1 for a loss,
+    with the final margin of boxes.
+    """
+    game = create_game(width)
+    edge_bytes = (len(game.moves) + 7) // 8
+    box_bytes = (len(game.box_cells) + 7) // 8
+    return np.dtype([('game', '<u4'), ('seed', '<u4'), ('ply', '<u2'), ('turn', 'u1'),
+                     ('edges', 'u1', (edge_bytes,)), ('first_boxes', 'u1', (box_bytes,)),
+                     ('second_boxes', 'u1', (box_bytes,)),
+                     ('visits', '<u4', (len(game.moves),)), ('outcome', 'i1'), ('margin', '<i2')])
+
+
+def pack_mask(mask, size):
+    """ Packs a bitmask into `size` little-endian bytes, as stored in the records. """
+    return np.frombuffer(mask.to_bytes(size, 'little'), dtype=np.uint8)
+
+
+def unpack_mask(packed):
+    """ Turns a packed bitmask of a record back into an integer (e.g. to compare it with State.edges). """
+    return int.from_bytes(np.asarray(packed, dtype=np.uint8).tobytes(), 'little')
+
+
+def unpack_bits(packed, count):
+    """ Unpacks the packed bitmasks of an array of records into an array of 0/1 values, one column per bit. """
+    return np.unpackbits(packed, axis=-1, count=count, bitorder='little')
+
+
+class ShardWriter:
+    def __init__(self, path, width, chunk_size=4096, level=6):
+        """ Appends position records to a shard, compressing them in chunks of `chunk_size` records. A chunk is written
+        as soon as it is full; the last, partial one when the writer is closed.
+
+        Args:
+            path:       The shard file, created if it does not exist.
+            width:      The size of the grid in vertices, which must match the shard's if it exists.
+            chunk_size: The number of records per chunk.
+            level:      The zlib compression level.
+
+        """
+        self.dtype = record_dtype(width)
+        self.chunk_size = chunk_size
+        self.level = level
+        self.buffer = np.zeros(chunk_size, dtype=self.dtype)
+        self.count = 0
+
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            with open(path, 'rb') as file:
+                magic, version, shard_width = FILE_HEADER.unpack(file.read(FILE_HEADER.size))
+            if magic != MAGIC or version != VERSION or shard_width != width:
+                raise ValueError("%s is not a shard of version %d for width %d" % (path, VERSION, width))
+        self.file = open(path, 'ab')
+        if not exists:
+            self.file.write(FILE_HEADER.pack(MAGIC, VERSION, width))
+
+    def append(self, records):
+        """ Appends an array of records of the shard's dtype. """
+        start = 0
+        while start < len(records):
+            part = records[start:start + self.chunk_size - self.count]
+            self.buffer[self.count:self.count + len(part)] = part
+            self.count += len(part)
+            start += len(part)
+            if self.count == self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        """ Writes the buffered records as a chunk. """
+        if self.count:
+            data = zlib.compress(self.buffer[:self.count].tobytes(), self.level)
+            self.file.write(CHUNK_HEADER.pack(self.count, len(data)))
+            self.file.write(data)
+            self.file.flush()
+            self.count = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ShardReader:
+    def __init__(self, path):
+        """ Reads a shard through a memory map. Only the chunk headers are read on opening; chunks are decompressed
+        one at a time as they are asked for.
+
+        Args:
+            path:   The shard file.
+
+        """
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.width = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a shard of version %d" % (path, VERSION))
+        self.dtype = record_dtype(self.width)
+
+        self.chunks = []        # (offset of the compressed data, its size, number of records) of every chunk
+        offset = FILE_HEADER.size
+        while offset + CHUNK_HEADER.size <= len(self.map):
+            count, size = CHUNK_HEADER.unpack_from(self.map, offset)
+            offset += CHUNK_HEADER.size
+            if offset + size > len(self.map):
+                # A chunk cut short by an interrupted writer
+                break
+            self.chunks.append((offset, size, count))
+            offset += size
+
+    def __len__(self):
+        """ The number of records of the shard. """
+        return sum(count for _, _, count in self.chunks)
+
+    def chunk(self, index):
+        """ Returns the records of a chunk as a NumPy array. """
+        offset, size, count = self.chunks[index]
+        return np.frombuffer(zlib.decompress(self.map[offset:offset + size]), dtype=self.dtype, count=count)
+
+    def __iter__(self):
+        for index in range(len(self.chunks)):
+            yield self.chunk(index)
+
+    def close(self):
+        self.map.close()
+
+
+def shard_paths(paths):
+    """ Returns the list of shard files given a shard file, a directory holding shards or a list of shard files. """
+    if isinstance(paths, str):
+        return sorted(glob.glob(os.path.join(paths, '*.shard'))) if os.path.isdir(paths) else [paths]
+    return list(paths)
+
+
+def iter_chunks(paths):
+    """ Yields the records of a number of shards chunk by chunk, as NumPy arrays, keeping a single chunk in memory.
+
+    Args:
+        paths:  Shard files, or a directory holding them.
+
+    """
+    for path in shard_paths(paths):
+        reader = ShardReader(path)
+        try:
+            for chunk in reader:
+                yield chunk
+        finally:
+            reader.close()
+
+
+def iter_positions(paths):
+    """ Yields the records of a number of shards one at a time (see iter_chunks). """
+    for chunk in iter_chunks(paths):
+        for record in chunk:
+            yield record
+
+
+def record_state(game, record):
+    """ Rebuilds the state of a record: its lines, the owners of its boxes and the player to move. As the order of the
+    moves and the owners of the lines are not recorded, the state has no history and its lines are all counted as
+    drawn by the second player.
+
+    Args:
+        game:   The game of the record's board (see p2_game.create_game).
+        record: A record of a shard.
+
+    Returns:    The State.
+
+    """
+    state = State(game)
+    for edge in edge_indices(unpack_mask(record['edges'])):
+        state.apply_move(game.moves[edge])
+    first_boxes = unpack_mask(record['first_boxes'])
+    second_boxes = unpack_mask(record['second_boxes'])
+    edge_keys, box_keys, turn_key = game.zobrist
+    state.turn = int(record['turn'])
+    state.first_edges = 0
+    state.first_boxes = first_boxes
+    state.box_counts = [first_boxes.bit_count(), second_boxes.bit_count()]
+    state.history = []
+    state.hash = turn_key if state.turn else 0
+    for edge in edge_indices(state.edges):
+        state.hash ^= edge_keys[edge]
+    for turn, boxes in enumerate((first_boxes, second_boxes)):
+        for box in edge_indices(boxes):
+            state.hash ^= box_keys[turn][box]
+    return state
+
+
+def root_visits(bot, state, move):
+    """ Returns the visits of every edge at the root of the search a bot just ran to choose a move in a state. Bots that
+    did not search the state (or do not search at all) count a single visit on the move.
+    """
+    visits = np.zeros(len(state.game.moves), dtype=np.uint32)
+    searcher = getattr(bot, 'searcher', None)
+    if searcher is not None and searcher.tree is not None and searcher.root_history == state.history:
+        tree = searcher.tree
+        visits[tree.child_edges(0)] = tree.visits[tree.child_indices(0)]
+    else:
+        visits[state.game.edge_ids[move]] = 1
+    return visits
+
+
+def play_shard(args):
+    """ Plays a number of games and streams their positions to a shard. Runs in the worker processes.
+
+    Args:
+        args:   The shard file, the chunk size and a list of game jobs as made by p2_sim.make_jobs.
+
+    Returns:    The number of games and positions written.
+
+    """
+    path, chunk_size, jobs = args
+    positions = 0
+    with ShardWriter(path, jobs[0]['width'], chunk_size) as writer:
+        for job in jobs:
+            bots = start_game(job)
+
+            game = create_game(job['width'])
+            edge_bytes = (len(game.moves) + 7) // 8
+            box_bytes = (len(game.box_cells) + 7) // 8
+            state = State(game)
+            records = []
+            while not state.is_terminal():
+                bot = bots[state.player_turn]
+                move = bot.think(state.copy())
+                records.append((job['game'], job['seed'], len(state.history), state.turn,
+                                pack_mask(state.edges, edge_bytes),
+                                pack_mask(state.first_boxes, box_bytes),
+                                pack_mask(state.boxes & ~state.first_boxes, box_bytes),
+                                root_visits(bot, state, move), 0, 0))
+                state.apply_move(move)
+
+            records = np.array(records, dtype=writer.dtype)
+            first, second = state.box_counts
+            margin = np.where(records['turn'] == 0, first - second, second - first)
+            records['margin'] = margin
+            records['outcome'] = np.sign(margin)
+            writer.append(records)
+            positions += len(records)
+    return len(jobs), positions
+
+
+def run_selfplay(pairings, games, out_dir, width=4, settings=None, seed=None, shards=None, workers=1,
+                 chunk_size=4096, verbose=True):
+    """ Plays games between pairs of bots over a process pool and writes their positions to shards.
+
+    The games are spread over the shards, each of which is written by one worker as its games are played. Shards that
+    already exist are appended to, so that further runs (with other seeds) add to a data set.
+
+    Args:
+        pairings:   A list of pairs of bot specifications (see p2_sim.configure). Colours alternate from one game to
+                    the next.
+        games:      The number of games per pairing.
+        out_dir:    The directory of the shards.
+        width:      The size of the grid in vertices.
+        settings:   A dictionary of parameter overrides such as {'mcts_vanilla.num_nodes': 500}.
+        seed:       The seed from which every game's seed is drawn. None picks one at random.
+        shards:     The number of shards; by default 4 per worker.
+        workers:    The number of processes playing games; 1 plays them in this process.
+        chunk_size: The number of records per compressed chunk.
+        verbose:    Whether to print the progress of the run.
+
+    Returns:        The number of games and positions written.
+
+    Raises:
+        ValueError: If a bot searches with num_workers > 1 while the games are played by several workers.
+
+    """
+    if seed is None:
+        seed = random.getrandbits(32)
+    settings = dict(DEFAULT_SETTINGS if settings is None else settings)
+    if workers > 1:
+        check_pool_bots(pairings, settings)
+    jobs = make_jobs(pairings, games, width, settings, seed, True)
+    shards = min(len(jobs), shards or 4 * workers)
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = [(os.path.join(out_dir, 'selfplay-%d-%05d.shard' % (width, index)), chunk_size, jobs[index::shards])
+             for index in range(shards)]
+
+    total_games = total_positions = 0
+    for played, positions in play_games(tasks, workers, play_shard):
+        total_games += played
+        total_positions += positions
+        if verbose:
+            print("%d/%d games, %d positions" % (total_games, len(jobs), total_positions))
+    return total_games, total_positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes the positions of self-play games to compressed shards.")
+    parser.add_argument('--pairing', nargs=2, action='append', metavar=('FIRST', 'SECOND'),
+                        help="Bot modules to pit against each other; may be repeated. Default: %s %s"
+                             % DEFAULT_PAIRING)
+    parser.add_argument('--games', type=int, default=100, help="Games per pairing (default 100).")
+    parser.add_argument('--width', type=int, default=4, help="Size of the grid in vertices (default 4).")
+    parser.add_argument('--set', type=parse_setting, action='append', default=[], metavar='BOT.PARAM=VALUE',
+                        help="Overrides a bot parameter, e.g. mcts_vanilla.num_nodes=500; may be repeated.")
+    parser.add_argument('--seed', type=int, help="Seed of the games, for reproducible data.")
+    parser.add_argument('--workers', type=int, default=1, help="Number of processes playing games (default 1).")
+    parser.add_argument('--shards', type=int, help="Number of shards (default 4 per worker).")
+    parser.add_argument('--chunk-size', type=int, default=4096, help="Records per compressed chunk (default 4096).")
+    parser.add_argument('--out', default='selfplay', help="Directory of the shards (default ./selfplay).")
+    args = parser.parse_args()
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(args.set)
+    games, positions = run_selfplay([tuple(pairing) for pairing in args.pairing or [DEFAULT_PAIRING]], args.games,
+                                    args.out, args.width, settings, args.seed, args.shards, args.workers,
+                                    args.chunk_size)
+    print("Wrote %d positions of %d games to %s" % (positions, games, args.out))
+
+
+if __name__ == '__main__':
+    main()
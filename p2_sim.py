@@ -1,48 +1,348 @@
-from p2_game import create_game, State
+import argparse
+import json
+import random
+from math import log10, sqrt
+from multiprocessing import Pool
+from time import process_time
 from timeit import default_timer as time
 
-# import random_bot as red_bot
-# import rollout_bot as red_bot
-# import rollout_bot as blue_bot
+import numpy as np
+
+from bot_instance import BotInstance, parse_bot, parse_value
+from mcts_search import TimeManager
+from mcts_telemetry import aggregate, Telemetry
+from p2_game import create_game, State
 
-import mcts_vanilla as blue_bot
-import mcts_modified as red_bot
+# By default, the simulation pits mcts_modified (red) against mcts_vanilla (blue) on a 4x4 grid, as it always has.
+DEFAULT_PAIRING = ('mcts_modified', 'mcts_vanilla')
 
-BOTS = {'red': red_bot, 'blue': blue_bot}
+# You can set the MCTS tree size like this (or with --set on the command line):
+DEFAULT_SETTINGS = {'mcts_modified.num_nodes': 1000, 'mcts_vanilla.num_nodes': 1000}
 
-# You can set the MCTS tree size like this:
-if hasattr(red_bot, 'num_nodes'):
-    red_bot.num_nodes = 1000
-if hasattr(blue_bot, 'num_nodes'):
-    blue_bot.num_nodes = 1000
 
-rounds = 100
-wins = {}
+def parse_setting(text):
+    """ Parses a command line override such as 'mcts_vanilla.explore_faction=1.5' into ('mcts_vanilla.explore_faction',
+    1.5), reading the value with bot_instance.parse_value.
+    """
+    name, _, value = text.partition('=')
+    if '.' not in name or not value:
+        raise argparse.ArgumentTypeError("Settings look like bot.parameter=value, got %r" % text)
+    return name, parse_value(value)
 
-start = time()  # To log how much time the simulation takes.
-for i in range(rounds):
 
-    print("")
-    print("Round %d, fight!" % i)
+def configure(bot_name, settings, seed, telemetry=False):
+    """ Creates an instance of a bot (see bot_instance) for one game, with its parameter overrides, its seed and, if
+    asked to, set up to record telemetry (for MCTS bots).
+
+    Args:
+        bot_name:   The specification of the bot: a module name, optionally with overrides of its own, as in
+                    'mcts_modified:num_nodes=500'. They take precedence over the overrides of `settings`.
+        settings:   A dictionary of parameter overrides for every bot, such as {'mcts_vanilla.num_nodes': 500}.
+        seed:       The seed of the bot's random number generator.
+        telemetry:  Whether the bot records telemetry.
+
+    Returns:        The BotInstance.
+
+    """
+    module_name, overrides = parse_bot(bot_name)
+    instance_settings = {}
+    for name, value in settings.items():
+        module, _, parameter = name.rpartition('.')
+        if module == module_name:
+            instance_settings[parameter] = value
+    instance_settings.update(overrides)
+    bot = BotInstance(module_name, instance_settings, seed)
+    if hasattr(bot, 'telemetry'):
+        bot.telemetry = Telemetry(bot_name) if telemetry else None
+    return bot
+
+
+def start_game(job, telemetry=False):
+    """ Seeds the random module with a game's seed and creates its bots, every bot seeded from the game's seed as well,
+    so that a game can be replayed from its job alone.
+
+    Args:
+        job:        A job as made by make_jobs.
+        telemetry:  Whether the MCTS bots record telemetry of their searches.
+
+    Returns:        A dictionary of the bots playing red and blue.
+
+    """
+    seed = job['seed']
+    random.seed(seed)
+    seeds = random.Random(seed)
+    return {'red': configure(job['red'], job['settings'], seeds.getrandbits(32), telemetry),
+            'blue': configure(job['blue'], job['settings'], seeds.getrandbits(32), telemetry)}
+
+
+def play_game(job):
+    """ Plays one game of a tournament. Runs in the worker processes.
 
-    game = create_game(4)   # Specify the size of the grid in vertices. In this case, 4x4
-    state = State(game)     # Create a state from the instance of the game
+    Args:
+        job:    A dictionary with the game number, its pairing index, the specifications of the bots playing red and
+                blue, the width, the parameter overrides, the seed of the game, whether to record telemetry and
+                the seconds every bot may spend on the game (None for no limit).
 
+    Returns:    A dictionary describing the game: the job, the winner, the final score, the seconds (of wall-clock and
+                of CPU time) every bot took for each of its moves and the telemetry records of every search of the MCTS
+                bots.
+
+    """
+    bots = start_game(job, job['telemetry'])
+    latencies = {'red': [], 'blue': []}
+    cpu_times = {'red': [], 'blue': []}
+    # With a time limit per game, every bot's moves are given deadlines by a time manager of its own
+    clocks = {colour: TimeManager(job['game_time']) for colour in bots} if job['game_time'] is not None else None
+
+    state = State(create_game(job['width']))
     while not state.is_terminal():
-        move = BOTS[state.player_turn].think(state.copy())
+        start = time()
+        start_cpu = process_time()
+        bot = bots[state.player_turn]
+        if clocks is None:
+            move = bot.think(state.copy())
+        else:
+            move = clocks[state.player_turn].think(bot, state.copy())
+        cpu_times[state.player_turn].append(process_time() - start_cpu)
+        latencies[state.player_turn].append(time() - start)
         state.apply_move(move)
 
-    final_score = state.score
-    winner = state.winner
-    print("The %s bot wins this round! (%s)" % (winner, str(final_score)))
-    wins[winner] = wins.get(winner, 0) + 1
-    # Debug statements
-    # print("")
-    # print("Wins: ", dict(wins))
+    # Every colour is played by an instance of its own, even when a bot plays itself
+    telemetry = {colour: bot.telemetry.records if getattr(bot, 'telemetry', None) is not None else []
+                 for colour, bot in bots.items()}
+    return dict(job, winner=state.winner, score=state.score, latencies=latencies, cpu_times=cpu_times,
+                telemetry=telemetry)
+
+
+def check_pool_bots(pairings, settings):
+    """ Checks that the bots of a number of pairings can play in the processes of a pool, which cannot start processes
+    of their own: none of them may search with num_workers > 1 (see mcts_core.think).
+
+    Args:
+        pairings:   A list of pairs of bot specifications (see configure).
+        settings:   A dictionary of parameter overrides for every bot, such as {'mcts_vanilla.num_workers': 2}.
+
+    Raises:
+        ValueError: If a bot searches with more than one worker process.
+
+    """
+    for bot_name in sorted({bot_name for pairing in pairings for bot_name in pairing}):
+        num_workers = getattr(configure(bot_name, settings, None), 'num_workers', 1)
+        if num_workers > 1:
+            raise ValueError("%s searches with %d worker processes, which it cannot start from the processes playing "
+                             "the games; play with a single worker, or set its num_workers to 1"
+                             % (bot_name, num_workers))
+
+
+def play_games(jobs, workers, play=play_game):
+    """ Plays the games of a list of jobs, in this process with a single worker and over a process pool otherwise.
+
+    Args:
+        jobs:       The jobs to play.
+        workers:    The number of processes playing games; 1 plays them in this process.
+        play:       The function playing a job, by default play_game. It must be a module-level function, so that it
+                    can be sent to the worker processes.
+
+    Returns:    An iterator over the results of play for every job, in the order they finish.
+
+    """
+    if workers == 1:
+        # Bots playing in this process may run root parallel searches over a pool of their own
+        yield from map(play, jobs)
+        return
+    with Pool(workers) as pool:
+        yield from pool.imap_unordered(play, jobs)
+
+
+def wilson_interval(successes, trials, z=1.96):
+    """ Returns the Wilson score interval (95% by default) of a proportion. """
+    if trials == 0:
+        return 0., 1.
+    p = successes / trials
+    center = (p + z * z / (2 * trials)) / (1 + z * z / trials)
+    margin = z * sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / (1 + z * z / trials)
+    return max(0., center - margin), min(1., center + margin)
+
+
+def elo_difference(score):
+    """ Returns the Elo rating difference corresponding to an expected score, clamped away from 0 and 1. """
+    score = min(max(score, 1e-3), 1 - 1e-3)
+    return -400 * log10(1 / score - 1)
+
+
+def latency_percentiles(latencies):
+    """ Returns the 50th, 90th and 99th percentile and the maximum of a list of move times, in milliseconds. """
+    if not latencies:
+        return {}
+    values = np.percentile(np.array(latencies) * 1000, [50, 90, 99, 100])
+    return dict(zip(('p50_ms', 'p90_ms', 'p99_ms', 'max_ms'), values.round(3).tolist()))
+
+
+def summarize(pairing, games):
+    """ Computes the statistics of the games of one pairing, from the point of view of its first bot.
+
+    Args:
+        pairing:    The specifications of the two bots.
+        games:      The results of the pairing's games, as returned by play_game.
+
+    Returns:        A dictionary with the win/loss/tie counts, the score rate of the first bot with its 95% confidence
+                    interval, the corresponding Elo differences, the move latency percentiles of both bots and their
+                    aggregated telemetry, if any was recorded.
+
+    """
+    first, second = pairing
+    wins = losses = ties = 0
+    latencies = {'first': [], 'second': []}
+    telemetry = {'first': [], 'second': []}
+    for game in games:
+        first_colour = 'red' if game['first_is_red'] else 'blue'
+        second_colour = 'blue' if game['first_is_red'] else 'red'
+        if game['winner'] == 'tie':
+            ties += 1
+        elif game['winner'] == first_colour:
+            wins += 1
+        else:
+            losses += 1
+        latencies['first'].extend(game['latencies'][first_colour])
+        latencies['second'].extend(game['latencies'][second_colour])
+        telemetry['first'].extend(game['telemetry'][first_colour])
+        telemetry['second'].extend(game['telemetry'][second_colour])
+
+    played = wins + losses + ties
+    score = (wins + ties / 2) / played if played else 0.5
+    low, high = wilson_interval(wins + ties / 2, played)
+    first_key = first if first != second else 'first'
+    second_key = second if first != second else 'second'
+    summary = {'first': first, 'second': second, 'games': played,
+               'wins': wins, 'losses': losses, 'ties': ties,
+               'score': score, 'score_ci95': [low, high],
+               'elo': elo_difference(score), 'elo_ci95': [elo_difference(low), elo_difference(high)],
+               'latency': {first_key: latency_percentiles(latencies['first']),
+                           second_key: latency_percentiles(latencies['second'])}}
+    if telemetry['first'] or telemetry['second']:
+        summary['telemetry'] = {first_key: aggregate(telemetry['first']), second_key: aggregate(telemetry['second'])}
+    return summary
+
+
+def make_jobs(pairings, games, width, settings, seed, swap_colours, telemetry=False, game_time=None):
+    """ Lists the games of a tournament, each with its own seed drawn from the tournament's seed. """
+    seeds = random.Random(seed)
+    jobs = []
+    for index, (first, second) in enumerate(pairings):
+        for game in range(games):
+            first_is_red = not (swap_colours and game % 2)
+            jobs.append({'game': len(jobs), 'pairing': index, 'first_is_red': first_is_red,
+                         'red': first if first_is_red else second, 'blue': second if first_is_red else first,
+                         'width': width, 'settings': settings, 'seed': seeds.getrandbits(32),
+                         'telemetry': telemetry, 'game_time': game_time})
+    return jobs
+
+
+def run_tournament(pairings, games, width=4, settings=None, seed=None, swap_colours=False, workers=1, verbose=True,
+                   telemetry=False, game_time=None):
+    """ Plays a number of games for every pairing of bots, in parallel over a process pool.
+
+    With a single worker, the games are played one after another in this process. Bots playing inside a pool cannot
+    start processes of their own, so with more workers, bots searching with num_workers > 1 are rejected.
+
+    Args:
+        pairings:       A list of pairs of bot specifications (see configure). The first bot of a pair plays red unless
+                        colours swap.
+        games:          The number of games per pairing.
+        width:          The size of the grid in vertices.
+        settings:       A dictionary of parameter overrides such as {'mcts_vanilla.num_nodes': 500}.
+        seed:           The seed of the tournament, from which every game's seed is drawn. None picks one at random.
+        swap_colours:   Whether the bots of a pairing alternate colours from one game to the next.
+        workers:        The number of processes playing games; 1 plays them in this process.
+        verbose:        Whether to print every game's result as it comes in.
+        telemetry:      Whether the MCTS bots record per-search telemetry (see mcts_telemetry), aggregated per pairing.
+        game_time:      If given, the seconds every bot may spend on a game, split over its moves (see
+                        mcts_search.TimeManager).
+
+    Returns:            A dictionary with the configuration, the results of every game and a summary per pairing.
+
+    Raises:
+        ValueError:     If a bot searches with num_workers > 1 while the games are played by several workers.
+
+    """
+    if seed is None:
+        seed = random.getrandbits(32)
+    settings = dict(DEFAULT_SETTINGS if settings is None else settings)
+    if workers > 1:
+        check_pool_bots(pairings, settings)
+    jobs = make_jobs(pairings, games, width, settings, seed, swap_colours, telemetry, game_time)
+
+    start = time()  # To log how much time the simulation takes.
+    results = []
+    for result in play_games(jobs, workers):
+        results.append(result)
+        if verbose:
+            print("Round %d (%s vs %s): the %s bot wins! (%s)" % (result['game'], result['red'], result['blue'],
+                                                                   result['winner'], str(result['score'])))
+    elapsed = time() - start
+    results.sort(key=lambda result: result['game'])
+
+    return {'config': {'pairings': [list(pairing) for pairing in pairings], 'games': games, 'width': width,
+                       'settings': settings, 'seed': seed, 'swap_colours': swap_colours, 'workers': workers,
+                       'telemetry': telemetry, 'game_time': game_time},
+            'seconds': elapsed,
+            'summary': [summarize(pairing, [result for result in results if result['pairing'] == index])
+                        for index, pairing in enumerate(pairings)],
+            'games': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plays Dots and Boxes tournaments between bots.")
+    parser.add_argument('--pairing', nargs=2, action='append', metavar=('FIRST', 'SECOND'),
+                        help="Bots to pit against each other, as module names optionally followed by overrides of "
+                             "their own (e.g. mcts_modified:num_nodes=500,explore_faction=0.5); may be repeated. "
+                             "Default: %s %s"
+                             % DEFAULT_PAIRING)
+    parser.add_argument('--games', type=int, default=100, help="Games per pairing (default 100).")
+    parser.add_argument('--width', type=int, default=4, help="Size of the grid in vertices (default 4).")
+    parser.add_argument('--set', type=parse_setting, action='append', default=[], metavar='BOT.PARAM=VALUE',
+                        help="Overrides a bot parameter, e.g. mcts_vanilla.num_nodes=500; may be repeated.")
+    parser.add_argument('--seed', type=int, help="Seed of the tournament, for reproducible results.")
+    parser.add_argument('--swap-colours', action='store_true', help="Alternate the colours of the bots every game.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of processes playing games (default 1, which plays them in this process).")
+    parser.add_argument('--json', metavar='PATH', help="Writes the results as JSON to this file.")
+    parser.add_argument('--telemetry', action='store_true',
+                        help="Records and summarizes the phase times and tree statistics of the MCTS bots' searches.")
+    parser.add_argument('--game-time', type=float, metavar='SECONDS',
+                        help="Seconds every bot may spend on a game, split over its moves; by default the bots play "
+                             "their fixed number of iterations.")
+    parser.add_argument('--quiet', action='store_true', help="Only prints the summary.")
+    args = parser.parse_args()
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(args.set)
+    report = run_tournament([tuple(pairing) for pairing in args.pairing or [DEFAULT_PAIRING]], args.games, args.width,
+                            settings, args.seed, args.swap_colours, args.workers, not args.quiet, args.telemetry,
+                            args.game_time)
+
+    print("")
+    for summary in report['summary']:
+        print("%s vs %s: %d wins, %d losses, %d ties; score %.3f [%.3f, %.3f], Elo %+.0f [%+.0f, %+.0f]"
+              % (summary['first'], summary['second'], summary['wins'], summary['losses'], summary['ties'],
+                 summary['score'], summary['score_ci95'][0], summary['score_ci95'][1],
+                 summary['elo'], summary['elo_ci95'][0], summary['elo_ci95'][1]))
+        for bot, percentiles in summary['latency'].items():
+            print("    %s move latency (ms): %s" % (bot, percentiles))
+        for bot, totals in summary.get('telemetry', {}).items():
+            if totals['searches']:
+                print("    %s search: %.0f iterations/s, %.0f nodes on average; time per phase: %s"
+                      % (bot, totals['iterations_per_second'], totals['mean_tree_nodes'],
+                         ', '.join('%s %.0f%%' % (phase, share * 100) for phase, share in totals['phase_shares'].items())))
+
+    # Also output the time elapsed.
+    print(report['seconds'], ' seconds (seed %d)' % report['config']['seed'])
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=1)
 
-print("")
-print("Final win counts:", dict(wins))
 
-# Also output the time elapsed.
-end = time()
-print(end-start, ' seconds')
+# The simulation only runs when this file is executed directly, as the worker processes import the main module.
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+import argparse
+import itertools
+import json
+import random
+from math import ceil
+
+from bot_instance import bot_spec, parse_bot, parse_value
+from p2_sim import DEFAULT_SETTINGS, parse_setting, run_tournament, wilson_interval
+
+
+def parse_values(text):
+    """ Parses a command line parameter range such as 'explore_faction=0.1,0.3,1.0' into ('explore_faction',
+    [0.1, 0.3, 1.0]), reading every value with bot_instance.parse_value.
+    """
+    name, _, values = text.partition('=')
+    if not name or not values:
+        raise argparse.ArgumentTypeError("Parameter ranges look like parameter=value,value,..., got %r" % text)
+    return name, [parse_value(value) for value in values.split(',')]
+
+
+def grid(params, samples=None, seed=None):
+    """ Lists the configurations of a parameter space.
+
+    Args:
+        params:     A list of (parameter name, list of values) pairs.
+        samples:    If given, the number of configurations drawn at random from the grid; by default all of them.
+        seed:       The seed of the draw.
+
+    Returns:        A list of dictionaries of parameter values.
+
+    """
+    names = [name for name, _ in params]
+    configurations = [dict(zip(names, values)) for values in itertools.product(*[values for _, values in params])]
+    if samples is not None and samples < len(configurations):
+        configurations = random.Random(seed).sample(configurations, samples)
+    return configurations
+
+
+def dominates(first, second):
+    """ Whether a candidate is at least as strong and as cheap as another, and strictly one of the two. """
+    return (first['score'] >= second['score'] and first['cpu_per_move'] <= second['cpu_per_move']
+            and (first['score'] > second['score'] or first['cpu_per_move'] < second['cpu_per_move']))
+
+
+def pareto_front(candidates):
+    """ Returns the candidates no other candidate dominates, from the cheapest to the most expensive. """
+    front = [candidate for candidate in candidates
+             if not any(dominates(other, candidate) for other in candidates if other is not candidate)]
+    return sorted(front, key=lambda candidate: candidate['cpu_per_move'])
+
+
+def final_front(candidates):
+    """ Returns the Pareto front of the candidates still in the race at its end, from the cheapest to the most
+    expensive. They all played the same number of games, while a candidate dropped early has a score over a few games
+    only, too noisy to be compared with theirs.
+    """
+    return pareto_front([candidate for candidate in candidates if candidate['dropped'] is None])
+
+
+def pareto_ranks(candidates):
+    """ Returns the Pareto rank of every candidate by specification: 0 on the front, 1 on the front of the rest... """
+    ranks = {}
+    left = list(candidates)
+    rank = 0
+    while left:
+        front = pareto_front(left)
+        for candidate in front:
+            ranks[candidate['spec']] = rank
+        left = [candidate for candidate in left if candidate['spec'] not in ranks]
+        rank += 1
+    return ranks
+
+
+def record_games(candidates, report):
+    """ Adds the results and CPU times of the candidates' games of a tournament to their totals. """
+    by_spec = {candidate['spec']: candidate for candidate in candidates}
+    for game in report['games']:
+        first_colour = 'red' if game['first_is_red'] else 'blue'
+        candidate = by_spec[game['red'] if game['first_is_red'] else game['blue']]
+        if game['winner'] == 'tie':
+            candidate['ties'] += 1
+        elif game['winner'] == first_colour:
+            candidate['wins'] += 1
+        else:
+            candidate['losses'] += 1
+        candidate['cpu_seconds'] += sum(game['cpu_times'][first_colour])
+        candidate['moves'] += len(game['cpu_times'][first_colour])
+
+    for candidate in candidates:
+        candidate['games'] = candidate['wins'] + candidate['losses'] + candidate['ties']
+        points = candidate['wins'] + candidate['ties'] / 2
+        candidate['score'] = points / candidate['games']
+        candidate['score_ci95'] = list(wilson_interval(points, candidate['games']))
+        candidate['cpu_per_move'] = candidate['cpu_seconds'] / max(1, candidate['moves'])
+
+
+def tune(bot, configurations, baseline, width=4, games=8, eta=2, rounds=None, settings=None, seed=None, workers=1,
+         verbose=True):
+    """ Races configurations of a bot against a baseline bot, with successive halving over parallel matches.
+
+    Every round, each configuration still in the race plays `games` more games against the baseline (alternating
+    colours), all of them spread over a process pool. The configurations are then ranked by Pareto front of their
+    score against the baseline and their CPU time per move, and only the best 1/eta of them go on to the next round,
+    which plays eta times as many games. A configuration is also dropped as soon as a cheaper one is known to score
+    better, i.e. when the lower bound of the other's 95% confidence interval is above its upper bound.
+
+    The CPU time is that of the process playing the game, so the bots should search with num_workers = 1.
+
+    Args:
+        bot:            The module name of the bot to tune, e.g. 'mcts_modified'.
+        configurations: A list of dictionaries of parameter overrides of the bot, e.g. from grid().
+        baseline:       The specification of the opponent (see p2_sim.configure), e.g. 'mcts_vanilla'.
+        width:          The size of the grid in vertices.
+        games:          The number of games per configuration of the first round.
+        eta:            The factor by which the configurations are cut and the games increased every round, above 1.
+        rounds:         The maximum number of rounds; by default until a single configuration is left.
+        settings:       A dictionary of parameter overrides for every bot, such as {'mcts_vanilla.num_nodes': 500}.
+        seed:           The seed of the race, from which the seed of every round is drawn.
+        workers:        The number of processes playing games.
+        verbose:        Whether to print the standings after every round.
+
+    Returns:            The list of candidates, each a dictionary with its specification, its parameters, its results
+                        against the baseline, its score with the 95% confidence interval, its CPU seconds per move and
+                        the round in which it was dropped (None for the ones left at the end).
+
+    Raises:
+        ValueError:     If eta is not above 1, as the race would then never narrow down.
+
+    """
+    if eta <= 1:
+        raise ValueError("eta must be above 1 for the configurations to be cut, got %r" % eta)
+    seeds = random.Random(seed)
+    candidates = [{'spec': bot_spec(bot, configuration), 'params': configuration, 'wins': 0, 'losses': 0, 'ties': 0,
+                   'games': 0, 'cpu_seconds': 0., 'moves': 0, 'dropped': None} for configuration in configurations]
+    alive = list(candidates)
+
+    round_number = 0
+    while alive and (rounds is None or round_number < rounds):
+        report = run_tournament([(candidate['spec'], baseline) for candidate in alive], games, width, settings,
+                                seeds.getrandbits(32), swap_colours=True, workers=workers, verbose=False)
+        record_games(alive, report)
+
+        # Racing: drop the configurations a cheaper one is significantly stronger than
+        beaten = [candidate for candidate in alive
+                  if any(other['cpu_per_move'] <= candidate['cpu_per_move']
+                         and other['score_ci95'][0] > candidate['score_ci95'][1] for other in alive)]
+        survivors = [candidate for candidate in alive if candidate not in beaten]
+        # Halving: keep the best fronts
+        ranks = pareto_ranks(survivors)
+        survivors.sort(key=lambda candidate: (ranks[candidate['spec']], -candidate['score']))
+        survivors = survivors[:max(1, ceil(len(alive) / eta))]
+        for candidate in alive:
+            if candidate not in survivors:
+                candidate['dropped'] = round_number
+
+        if verbose:
+            print("Round %d: %d games per configuration, %d of %d configurations left"
+                  % (round_number, games, len(survivors), len(alive)))
+            for candidate in sorted(alive, key=lambda candidate: candidate['cpu_per_move']):
+                print("    %-60s score %.3f [%.3f, %.3f], %.2f ms per move%s"
+                      % (candidate['spec'], candidate['score'], candidate['score_ci95'][0], candidate['score_ci95'][1],
+                         candidate['cpu_per_move'] * 1000, '' if candidate in survivors else ' (dropped)'))
+
+        round_number += 1
+        if len(survivors) == 1:
+            break
+        alive = survivors
+        games *= eta
+    return candidates
+
+
+def cheapest(front, target):
+    """ Returns the cheapest candidate of a Pareto front whose score reaches a target, or None if none does. """
+    for candidate in front:
+        if candidate['score'] >= target:
+            return candidate
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tunes the parameters of a bot by racing its configurations against "
+                                                 "a baseline, and prints the strength versus CPU time Pareto front.")
+    parser.add_argument('bot', help="Bot to tune, as a module name optionally followed by fixed overrides "
+                                    "(e.g. mcts_modified:rave_bias=None).")
+    parser.add_argument('--param', type=parse_values, action='append', default=[], metavar='PARAM=VALUE,VALUE',
+                        help="Values to try for a parameter of the bot, e.g. explore_faction=0.1,0.3,1.0; may be "
+                             "repeated, the configurations being all the combinations.")
+    parser.add_argument('--samples', type=int, help="Number of configurations drawn at random (default all).")
+    parser.add_argument('--baseline', default='mcts_vanilla', help="Opponent of the configurations (default "
+                                                                   "mcts_vanilla).")
+    parser.add_argument('--width', type=int, default=4, help="Size of the grid in vertices (default 4).")
+    parser.add_argument('--set', type=parse_setting, action='append', default=[], metavar='BOT.PARAM=VALUE',
+                        help="Overrides a parameter of every instance of a bot, e.g. mcts_vanilla.num_nodes=500; may "
+                             "be repeated. The configurations' own values take precedence.")
+    parser.add_argument('--games', type=int, default=8, help="Games per configuration of the first round (default 8).")
+    parser.add_argument('--eta', type=int, default=2, help="Factor of the successive halving, above 1 (default 2).")
+    parser.add_argument('--rounds', type=int, help="Maximum number of rounds (default until one is left).")
+    parser.add_argument('--target', type=float, default=0.5,
+                        help="Score against the baseline to reach; the cheapest configuration left at the end of the race "
+                             "reaching it is recommended (default 0.5).")
+    parser.add_argument('--seed', type=int, help="Seed of the race, for reproducible results.")
+    parser.add_argument('--workers', type=int, default=1, help="Number of processes playing games (default 1).")
+    parser.add_argument('--json', metavar='PATH', help="Writes the candidates and the front as JSON to this file.")
+    args = parser.parse_args()
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(args.set)
+    bot, fixed = parse_bot(args.bot)
+    configurations = [dict(fixed, **configuration) for configuration in grid(args.param, args.samples, args.seed)]
+    candidates = tune(bot, configurations, args.baseline, args.width, args.games, args.eta, args.rounds,
+                      settings, args.seed, args.workers)
+
+    front = final_front(candidates)
+    print("")
+    print("Pareto front of the configurations left (score against %s versus CPU time per move):" % args.baseline)
+    for candidate in front:
+        print("    %-60s score %.3f over %d games, %.2f ms per move"
+              % (candidate['spec'], candidate['score'], candidate['games'], candidate['cpu_per_move'] * 1000))
+    choice = cheapest(front, args.target)
+    if choice is None:
+        print("No configuration reaches a score of %.3f" % args.target)
+    else:
+        print("Cheapest configuration scoring %.3f or more: %s" % (args.target, choice['spec']))
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'candidates': candidates, 'front': [candidate['spec'] for candidate in front]}, file, indent=1)
+
+
+# The worker processes import the main module, so the race only runs when this file is executed directly.
+if __name__ == '__main__':
+    main()
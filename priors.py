@@ -0,0 +1,18 @@
+
+from p2_game import edge_indices
+
+# A prior picks the untried move of a node to expand first, as prior(state, untried, rng) with the state of the node,
+# the bitmask of its untried edge indices and the random number generator of the search. It returns an edge index.
+
+
+def uniform(state, untried, rng):
+    """ Picks any untried move at random. """
+    return rng.choice(edge_indices(untried))
+
+
+def safe_first(state, untried, rng):
+    """ Picks an untried capture at random if there is one, else a line that gives no box away, else any line. """
+    for preferred in (state.capture_edges & untried, state.safe_edges & untried):
+        if preferred:
+            return rng.choice(edge_indices(preferred))
+    return rng.choice(edge_indices(untried))
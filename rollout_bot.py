@@ -1,7 +1,13 @@
 import random
+from p2_game import edge_indices
 
 ROLLOUTS = 10
 MAX_DEPTH = 5
+VECTORIZED = False  # Whether all the rollouts are played together by rollout_engine.play_out
+EVALUATOR = None    # Leaf evaluator (see mcts_batch), e.g. evaluation.LinearEvaluator(), scoring the states reached
+                    # after MAX_DEPTH random moves by their chance of winning instead of their score difference
+
+rng = random.Random()  # Random number generator of the rollouts; seed it for reproducible moves
 
 
 def think(state):
@@ -27,22 +33,50 @@ def think(state):
         blue_score = score.get('blue', 0)
         return red_score - blue_score if me == 'red' else blue_score - red_score
 
+    if EVALUATOR is not None:
+        # Play the ROLLOUTS games of every move to depth MAX_DEPTH, then sum the evaluations of their states per move.
+        ends = []
+        for move in moves:
+            start = state.copy()
+            start.apply_move(move)
+            for r in range(ROLLOUTS):
+                end = start.copy()
+                remaining = edge_indices(end.game.all_edges & ~end.edges)
+                for edge in rng.sample(remaining, min(MAX_DEPTH, len(remaining))):
+                    end.apply_move(end.game.moves[edge])
+                ends.append(end)
+        values = EVALUATOR(ends, me)
+        expectations = [sum(values[i * ROLLOUTS:(i + 1) * ROLLOUTS]) for i in range(len(moves))]
+        return moves[expectations.index(max(expectations))]
+
+    if VECTORIZED:
+        # NumPy is only needed here, so it is only imported when the rollouts are vectorized
+        import numpy as np
+        from rollout_engine import play_out
+
+        # Play the ROLLOUTS games of every move in one batch, then average the score differences per move. The NumPy
+        # generator of the batch is seeded from rng, so that seeding rng makes the moves reproducible.
+        starts = []
+        for move in moves:
+            start = state.copy()
+            start.apply_move(move)
+            starts.extend([start] * ROLLOUTS)
+        margins = play_out(starts, MAX_DEPTH, np.random.default_rng(rng.getrandbits(64)))
+        margins = margins.reshape(len(moves), ROLLOUTS).mean(axis=1)
+        if me != state.game.players[0]:
+            margins = -margins
+        return moves[int(margins.argmax())]
+
     for move in moves:
         total_score = 0.0
 
         # Sample a set number of games where the target move is immediately applied.
+        rollout_state = state.copy()
+        rollout_state.apply_move(move)
         for r in range(ROLLOUTS):
-            rollout_state = state.copy()
-            rollout_state.apply_move(move)
-
-            # Only play to the specified depth.
-            for i in range(MAX_DEPTH):
-                if rollout_state.is_terminal():
-                    break
-                rollout_move = random.choice(rollout_state.legal_moves)
-                rollout_state.apply_move(rollout_move)
-
-            total_score += outcome(rollout_state.score)
+            # Only play to the specified depth. The playout shuffles the remaining lines once and leaves the state as is.
+            red_score, blue_score = rollout_state.playout(rng, MAX_DEPTH)
+            total_score += outcome({'red': red_score, 'blue': blue_score})
 
         expectation = float(total_score) / ROLLOUTS
 
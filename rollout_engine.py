@@ -0,0 +1,132 @@
+import random
+
+import numpy as np
+
+from p2_game import edge_indices
+
+def heuristic_playout(state, rng, max_moves=None):
+    """ Plays a state out in place with the rollout policy of the heuristic bots: close a box whenever one has three
+    sides, otherwise draw a random line that gives no box away, and only when there is none left, any random line.
+
+    Args:
+        state:      The state of the game, which is played out.
+        rng:        The random.Random generator (or the random module) choosing the lines.
+        max_moves:  If given, the number of moves after which the playout stops, e.g. before a static evaluation.
+
+    """
+    game = state.game
+    moves_left = len(game.moves) if max_moves is None else max_moves
+    while moves_left and not state.is_terminal():
+        # Heuristic to complete a horse-shoe shape if possible
+        capturable = state.capturable_boxes
+        if capturable:
+            box = (capturable & -capturable).bit_length() - 1
+            edge = (game.box_edges[box] & ~state.edges).bit_length() - 1
+        else:
+            # Heuristic to not make a box for the other player to close, if it can be helped
+            edge = rng.choice(edge_indices(state.safe_edges or state.legal_edges))
+        state.apply_move(game.moves[edge])
+        moves_left -= 1
+
+
+# Per-game lookup tables, keyed by board width.
+_tables = {}
+
+
+def _edge_box_table(game):
+    """ Returns, for a game, the (number of edges, 2) array of the boxes bordering every edge. Edges on the border of the
+    board have a single box; their second entry is the dummy box index len(game.box_cells), which is never checked.
+    """
+    table = _tables.get(game.width)
+    if table is None:
+        dummy = len(game.box_cells)
+        table = np.full((len(game.moves), 2), dummy, dtype=np.intp)
+        for edge, boxes in enumerate(game.edge_boxes):
+            table[edge, :len(boxes)] = boxes
+        _tables[game.width] = table
+    return table
+
+
+def _edge_array(states, num_edges):
+    """ Unpacks the drawn edges of the states into a (number of states, number of edges) boolean array. """
+    num_bytes = (num_edges + 7) // 8
+    packed = np.frombuffer(b''.join(state.edges.to_bytes(num_bytes, 'little') for state in states), dtype=np.uint8)
+    return np.unpackbits(packed.reshape(len(states), num_bytes), axis=1, bitorder='little')[:, :num_edges].astype(bool)
+
+
+def play_out(states, max_depth=None, rng=None):
+    """ Plays random games from a batch of states in lock-step, one move of every game per step.
+
+    A uniformly random playout draws the remaining edges in a random order, so every game is given a random
+    permutation of its undrawn edges up front. Each step then draws the next edge of every unfinished game, adds it to
+    the side counts of the boxes it borders and awards the boxes reaching four sides to the player to move, who keeps the
+    turn if a box was completed.
+
+    Args:
+        states:     A list of states of the same game. They are not modified.
+        max_depth:  If given, the number of moves after which every game is stopped, as in rollout_bot.
+        rng:        The NumPy random Generator to draw from; by default one seeded from the random module's generator,
+                    so that seeding the random module makes the playouts reproducible.
+
+    Returns:        An array with, for every game, the number of boxes of the first player minus those of the second.
+
+    """
+    if rng is None:
+        rng = np.random.default_rng(random.getrandbits(64))
+    game = states[0].game
+    num_games = len(states)
+    num_edges = len(game.moves)
+    num_boxes = len(game.box_cells)
+    edge_boxes = _edge_box_table(game)
+
+    drawn = _edge_array(states, num_edges)
+    sides = np.zeros((num_games, num_boxes + 1), dtype=np.int16)
+    sides[:, :num_boxes] = np.frombuffer(b''.join(bytes(state.box_sides) for state in states),
+                                         dtype=np.uint8).reshape(num_games, num_boxes)
+    scores = np.array([state.box_counts for state in states], dtype=np.int32)
+    turn = np.array([state.turn for state in states], dtype=np.intp)
+
+    # Random permutation of the undrawn edges of every game, followed by its drawn edges
+    keys = rng.random((num_games, num_edges))
+    keys[drawn] = 2.
+    order = np.argsort(keys, axis=1)
+    moves_left = num_edges - drawn.sum(axis=1)
+    if max_depth is not None:
+        moves_left = np.minimum(moves_left, max_depth)
+
+    rows = np.arange(num_games)
+    for step in range(int(moves_left.max(initial=0))):
+        active = step < moves_left
+        edge = order[:, step]
+        first_box = edge_boxes[edge, 0]
+        second_box = edge_boxes[edge, 1]
+
+        sides[rows, first_box] += active
+        sides[rows, second_box] += active
+        completed = (active & (first_box < num_boxes) & (sides[rows, first_box] == 4)).astype(np.int32)
+        completed += active & (second_box < num_boxes) & (sides[rows, second_box] == 4)
+
+        scores[rows, turn] += completed
+        turn = np.where(active & (completed == 0), 1 - turn, turn)
+
+    return scores[:, 0] - scores[:, 1]
+
+
+class VectorizedEvaluator:
+    def __init__(self, playouts=1, rng=None):
+        """ A batch evaluator for the MCTS bots (see mcts_batch) that plays the leaves out with play_out.
+
+        Args:
+            playouts:   The number of random playouts per leaf; the result of a leaf is its fraction of playouts won.
+            rng:        The NumPy random Generator to draw from; by default a new one is seeded from the random
+                        module's generator on every call (see play_out).
+
+        """
+        self.playouts = playouts
+        self.rng = rng
+
+    def __call__(self, states, identity):
+        margins = play_out([state for state in states for _ in range(self.playouts)], rng=self.rng)
+        if identity != states[0].game.players[0]:
+            margins = -margins
+        return (margins > 0).reshape(len(states), self.playouts).mean(axis=1).tolist()
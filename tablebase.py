@@ -0,0 +1,184 @@
+
+import argparse
+import os
+from multiprocessing import Pool
+from timeit import default_timer as time
+
+import numpy as np
+
+from p2_game import create_game
+
+# Boards up to 3x3 boxes (4x4 vertices, 24 lines and a 16 MiB table) can be enumerated completely
+MAX_WIDTH = 4
+
+# Tables are loaded once per file, keyed by absolute path; None records that a file holds no (complete) table
+_tables = {}
+
+
+def default_path(width):
+    """ Returns the default location of a board's table, next to this module. """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tablebase_%d.bin' % width)
+
+
+def _progress_path(path):
+    """ Returns the file recording the progress of an unfinished build of a table. """
+    return path + '.progress'
+
+
+def _popcounts(bits):
+    """ Returns the number of set bits of every integer below 2 ** bits, as an array of uint8. """
+    masks = np.arange(1 << bits, dtype=np.uint32)
+    counts = np.zeros(1 << bits, dtype=np.uint8)
+    for bit in range(bits):
+        counts += ((masks >> bit) & 1).astype(np.uint8)
+    return counts
+
+
+# The game and the open table of a builder's worker process
+_worker_game = None
+_worker_table = None
+
+
+def _open_worker(width, path):
+    global _worker_game, _worker_table
+    _worker_game = create_game(width)
+    _worker_table = np.memmap(path, dtype=np.int8, mode='r+')
+
+
+def _solve_chunk(masks):
+    """ Computes and writes the values of a chunk of positions, all with the same number of lines drawn, from those of
+    the positions with one more line. Runs in the builder's worker processes.
+    """
+    game, table = _worker_game, _worker_table
+    best = np.full(len(masks), -128, dtype=np.int16)
+    for edge, boxes in enumerate(game.edge_boxes):
+        bit = 1 << edge
+        free = (masks & bit) == 0
+        if not free.any():
+            continue
+        children = masks[free] | bit
+        closed = np.zeros(len(children), dtype=np.int16)
+        for box in boxes:
+            box_mask = game.box_edges[box]
+            closed += (children & box_mask) == box_mask
+        values = table[children].astype(np.int16)
+        # Closing a box gives the player another turn
+        values = np.where(closed > 0, closed + values, -values)
+        best[free] = np.maximum(best[free], values)
+    table[masks] = best
+    table.flush()
+    return len(masks)
+
+
+def build(width, path=None, workers=1, chunk_size=1 << 18, verbose=True):
+    """ Builds the table of a board by retrograde analysis, resuming an interrupted build if there is one.
+
+    The table holds one signed byte per set of drawn lines, indexed by the edge mask (see p2_game.State.edges): the
+    number of boxes the player to move will close from there on minus the number the opponent will, with perfect play
+    on both sides. Neither the boxes already closed nor the side to move change it. Positions are solved by decreasing
+    number of lines drawn, each level from the one above, with the positions of a level spread over a pool of processes.
+    The progress file next to the table records the last level completed until the build is over.
+
+    Args:
+        width:      The size of the grid in vertices, at most MAX_WIDTH.
+        path:       The file to write the table to; by default default_path(width).
+        workers:    The number of worker processes.
+        chunk_size: The number of positions solved per task of a worker.
+        verbose:    Whether to print the progress of the build.
+
+    Returns:        The path of the table.
+
+    """
+    if width > MAX_WIDTH:
+        raise ValueError("Tables are only built for boards up to %d vertices wide" % MAX_WIDTH)
+    path = path or default_path(width)
+    progress_path = _progress_path(path)
+    lines = len(create_game(width).moves)
+
+    if os.path.exists(path) and not os.path.exists(progress_path):
+        return path
+    if os.path.exists(progress_path):
+        with open(progress_path) as file:
+            done = int(file.read())
+    else:
+        # The progress file goes first, so that a build interrupted from now on never passes for a complete one
+        with open(progress_path, 'w') as file:
+            file.write(str(lines))
+        done = lines
+    if done == lines:
+        # A table of zeros, which is right for the full board
+        np.memmap(path, dtype=np.int8, mode='w+', shape=(1 << lines,)).flush()
+
+    popcounts = _popcounts(lines)
+    with Pool(workers, initializer=_open_worker, initargs=(width, path)) as pool:
+        for level in range(done - 1, -1, -1):
+            start = time()
+            masks = np.flatnonzero(popcounts == level).astype(np.uint32)
+            chunks = [masks[i:i + chunk_size] for i in range(0, len(masks), chunk_size)]
+            # The whole level must be written before the progress is recorded
+            sum(pool.imap_unordered(_solve_chunk, chunks))
+            with open(progress_path, 'w') as file:
+                file.write(str(level))
+            if verbose:
+                print("Level %d: %d positions in %.1f seconds" % (level, len(masks), time() - start))
+    os.remove(progress_path)
+    # A table loaded before from this file is out of date
+    _tables.pop(os.path.abspath(path), None)
+    return path
+
+
+def load(game, path=None):
+    """ Returns the table of a game's board, memory-mapped read-only, or None if it has not been built (completely).
+
+    Args:
+        game:   The game (see p2_game.create_game).
+        path:   The file of the table; by default default_path(game.width).
+
+    """
+    path = os.path.abspath(path or default_path(game.width))
+    if path not in _tables:
+        table = None
+        if game.width <= MAX_WIDTH and os.path.exists(path) and not os.path.exists(_progress_path(path)):
+            table = np.memmap(path, dtype=np.int8, mode='r')
+        _tables[path] = table
+    return _tables[path]
+
+
+def best_move(table, state):
+    """ Looks up the values of the positions a move leads to and returns a best one.
+
+    Args:
+        table:  The table of the state's board, as returned by load().
+        state:  The state of the game, which must not be over.
+
+    Returns:    A pair of the margin of the position for the player to move (see build) and a move reaching it.
+
+    """
+    game = state.game
+    edges = state.edges
+    best_value, best_edge = None, None
+    remaining = game.all_edges & ~edges
+    while remaining:
+        bit = remaining & -remaining
+        remaining ^= bit
+        edge = bit.bit_length() - 1
+        child = edges | bit
+        closed = sum(1 for box in game.edge_boxes[edge] if child & game.box_edges[box] == game.box_edges[box])
+        value = closed + int(table[child]) if closed else -int(table[child])
+        if best_value is None or value > best_value:
+            best_value, best_edge = value, edge
+    return best_value, game.moves[best_edge]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds the endgame table of a small board.")
+    parser.add_argument('--width', type=int, default=MAX_WIDTH,
+                        help="Size of the grid in vertices (default and maximum %d)." % MAX_WIDTH)
+    parser.add_argument('--path', help="File to write the table to (default tablebase_<width>.bin here).")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of worker processes.")
+    args = parser.parse_args()
+    print(build(args.width, args.path, args.workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import random
+
+import pytest
+
+from endgame import EndgameSolver
+from p2_game import create_game, State
+
+
+def brute_force(state, memo):
+    """ Returns the margin of a position for the player to move by trying every move, without pruning. """
+    if state.is_terminal():
+        return 0
+    if state.edges not in memo:
+        best = None
+        for move in state.legal_moves:
+            turn = state.turn
+            before = state.box_counts[turn]
+            state.apply_move(move)
+            closed = state.box_counts[turn] - before
+            value = closed + brute_force(state, memo) if state.turn == turn else -brute_force(state, memo)
+            state.undo_move()
+            if best is None or value > best:
+                best = value
+        memo[state.edges] = best
+    return memo[state.edges]
+
+
+@pytest.mark.parametrize('width', [2, 3])
+@pytest.mark.parametrize('seed', range(10))
+def test_solver_matches_brute_force(width, seed):
+    rng = random.Random(seed)
+    game = create_game(width)
+    solver = EndgameSolver(game)
+    memo = {}
+    state = State(game)
+    while not state.is_terminal():
+        value, move = solver.solve(state)
+        assert value == brute_force(state, memo)
+        # The move returned reaches the value
+        turn = state.turn
+        before = state.box_counts[turn]
+        state.apply_move(move)
+        closed = state.box_counts[turn] - before
+        assert value == (closed + brute_force(state, memo) if state.turn == turn else -brute_force(state, memo))
+        state.undo_move()
+        state.apply_move(rng.choice(state.legal_moves))
@@ -0,0 +1,128 @@
+import random
+from collections import Counter
+
+import pytest
+
+from p2_game import create_game, State
+
+
+class ReferenceState:
+    """ The original dictionary-based State, which the bitboard State must agree with move for move. """
+
+    def __init__(self, game):
+        self.game = game
+        self.player_turn = game.players[0]
+        self.box_owners = {}
+        self.h_line_owners = {}
+        self.v_line_owners = {}
+
+    def apply_move(self, move):
+        orientation, cell = move
+        x, y = cell
+        if orientation == 'h':
+            self.h_line_owners[cell] = self.player_turn
+            box_checks = [(x, y - 1), (x, y)]
+        else:
+            self.v_line_owners[cell] = self.player_turn
+            box_checks = [(x - 1, y), (x, y)]
+
+        new_boxes = False
+        for (i, j) in box_checks:
+            if (i, j) not in self.box_owners \
+                    and (i, j) in self.h_line_owners \
+                    and (i, j) in self.v_line_owners \
+                    and (i, j + 1) in self.h_line_owners \
+                    and (i + 1, j) in self.v_line_owners:
+                new_boxes = True
+                self.box_owners[(i, j)] = self.player_turn
+        if not new_boxes:
+            players = self.game.players
+            self.player_turn = players[(players.index(self.player_turn) + 1) % len(players)]
+
+    def is_terminal(self):
+        return len(self.box_owners) == len(self.game.boxes)
+
+    @property
+    def legal_moves(self):
+        return ([('h', h) for h in self.game.h_lines if h not in self.h_line_owners] +
+                [('v', v) for v in self.game.v_lines if v not in self.v_line_owners])
+
+    @property
+    def score(self):
+        return dict(Counter(self.box_owners.values()))
+
+    @property
+    def winner(self):
+        if len(self.score) == 0:
+            return 'tie'
+        player, winning_score = max(self.score.items(), key=lambda pair: pair[1])
+        if winning_score == len(self.game.boxes) / 2:
+            return 'tie'
+        return player
+
+
+def snapshot(state):
+    """ Returns everything apply_move and undo_move update. """
+    return (state.edges, state.first_edges, state.boxes, state.first_boxes, tuple(state.box_counts),
+            bytes(state.box_sides), state.turn, state.hash, tuple(state.side_masks), state.unsafe_edges,
+            bytes(state.unsafe_counts), len(state.history))
+
+
+@pytest.mark.parametrize('width', [2, 3, 4, 5])
+@pytest.mark.parametrize('seed', range(5))
+def test_undo_restores_every_position_of_a_random_game(width, seed):
+    rng = random.Random(seed)
+    state = State(create_game(width))
+    positions = []
+    tokens = []
+    while not state.is_terminal():
+        positions.append(snapshot(state))
+        tokens.append(state.apply_move(rng.choice(state.legal_moves)))
+    while tokens:
+        state.undo_move(tokens.pop())
+        assert snapshot(state) == positions.pop()
+    assert snapshot(state) == snapshot(State(state.game))
+
+
+@pytest.mark.parametrize('width', [2, 3, 4, 5])
+@pytest.mark.parametrize('seed', range(5))
+def test_state_agrees_with_the_reference_implementation(width, seed):
+    rng = random.Random(seed)
+    game = create_game(width)
+    state = State(game)
+    reference = ReferenceState(game)
+    while not reference.is_terminal():
+        assert state.player_turn == reference.player_turn
+        assert sorted(state.legal_moves) == sorted(reference.legal_moves)
+        assert not state.is_terminal()
+        move = rng.choice(reference.legal_moves)
+        state.apply_move(move)
+        reference.apply_move(move)
+        assert dict(state.box_owners) == reference.box_owners
+        assert dict(state.h_line_owners) == reference.h_line_owners
+        assert dict(state.v_line_owners) == reference.v_line_owners
+        assert state.score == reference.score
+    assert state.is_terminal()
+    assert state.winner == reference.winner
+
+
+def test_hash_depends_on_the_position_only():
+    game = create_game(3)
+    first, second = State(game), State(game)
+    # The same lines drawn in two orders, neither closing a box, with the same player to move
+    for move in [('h', (0, 0)), ('v', (2, 0)), ('h', (1, 2))]:
+        first.apply_move(move)
+    for move in [('h', (1, 2)), ('v', (2, 0)), ('h', (0, 0))]:
+        second.apply_move(move)
+    assert first.hash == second.hash
+    second.undo_move()
+    assert first.hash != second.hash
+
+
+def test_drawing_a_drawn_line_is_rejected():
+    state = State(create_game(3))
+    state.apply_move(('h', (0, 0)))
+    before = snapshot(state)
+    with pytest.raises(ValueError):
+        state.apply_move(('h', (0, 0)))
+    assert snapshot(state) == before
@@ -0,0 +1,25 @@
+from p2_tune import cheapest, final_front
+
+
+def candidate(spec, score, cpu_per_move, games, dropped=None):
+    return {'spec': spec, 'params': {}, 'games': games, 'score': score, 'cpu_per_move': cpu_per_move,
+            'dropped': dropped}
+
+
+def test_final_front_ignores_candidates_dropped_early():
+    # A cheap configuration that won its two games of the first round before being cut by the halving
+    lucky = candidate('mcts_modified:num_nodes=10', 1., 0.001, 2, dropped=0)
+    finalists = [candidate('mcts_modified:num_nodes=100', 0.6, 0.01, 14),
+                 candidate('mcts_modified:num_nodes=400', 0.8, 0.04, 14)]
+    front = final_front([lucky] + finalists)
+    assert front == finalists
+    assert cheapest(front, 0.5) is finalists[0]
+    assert cheapest(front, 0.7) is finalists[1]
+    assert cheapest(front, 0.9) is None
+
+
+def test_final_front_keeps_only_undominated_finalists():
+    cheap = candidate('a', 0.5, 0.01, 8)
+    dominated = candidate('b', 0.4, 0.02, 8)
+    strong = candidate('c', 0.7, 0.03, 8)
+    assert final_front([strong, dominated, cheap]) == [cheap, strong]
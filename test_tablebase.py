@@ -0,0 +1,24 @@
+import random
+
+import tablebase
+from endgame import EndgameSolver
+from p2_game import create_game, State
+
+
+def test_table_matches_solver(tmp_path):
+    game = create_game(3)
+    path = tablebase.build(3, str(tmp_path / 'tablebase_3.bin'), verbose=False)
+    table = tablebase.load(game, path)
+    assert table is not None
+    solver = EndgameSolver(game)
+    bound = len(game.box_cells) + 1
+    for edges in range(1 << len(game.moves)):
+        assert int(table[edges]) == solver.negamax(edges, -bound, bound)
+
+    # Best moves read from the table are worth what the solver finds
+    rng = random.Random(0)
+    for _ in range(20):
+        state = State(game)
+        while not state.is_terminal():
+            assert tablebase.best_move(table, state)[0] == solver.solve(state)[0]
+            state.apply_move(rng.choice(state.legal_moves))